@@ -58,6 +58,7 @@ with DAG(
             filename_template=filename_template,
             # year=context['execution_date'].year,
             year=2025,
+            with_meta=True,  # ETag/размер нужны для сравнения с манифестом bronze
         )
     )
 
@@ -87,6 +88,27 @@ with DAG(
         "/opt/spark/external-jars/minio/aws-java-sdk-bundle-1.12.262.jar",
         "/opt/spark/external-jars/minio/wildfly-openssl-1.0.7.Final.jar",
         "/opt/spark/external-jars/postgre/postgresql-42.6.0.jar",
+        # Коммиттеры S3A для Spark SQL (PathOutputCommitProtocol)
+        "/opt/spark/external-jars/minio/spark-hadoop-cloud_2.12-3.5.0.jar",
+    ]
+
+    # Запись в silver через S3A magic коммиттер: файлы задач загружаются multipart
+    # upload'ами прямо в MinIO и становятся видимыми на commit джоба без rename.
+    # Общая файловая система для драйвера (контейнер Airflow) и экзекуторов ему не нужна
+    spark_committer_conf = {
+        "spark.hadoop.fs.s3a.committer.name": "magic",
+        "spark.hadoop.fs.s3a.committer.magic.enabled": "true",
+        "spark.hadoop.mapreduce.outputcommitter.factory.scheme.s3a": "org.apache.hadoop.fs.s3a.commit.S3ACommitterFactory",
+        "spark.sql.sources.commitProtocolClass": "org.apache.spark.internal.io.cloud.PathOutputCommitProtocol",
+        "spark.sql.parquet.output.committer.class": "org.apache.spark.internal.io.cloud.BindingParquetOutputCommitter",
+    }
+
+    # Общие python модули для Spark джобов (драйвер и экзекуторы)
+    spark_py_files = [
+        "/opt/airflow/module/storage.py",
+        "/opt/airflow/module/query_cache.py",
+        "/opt/airflow/module/nyc_taxi_schema.py",
+        "/opt/airflow/module/spark_writer.py",
     ]
 
 
@@ -99,6 +121,8 @@ with DAG(
         ],
         conn_id='spark_cluster',
         jars=','.join(spark_drivers),
+        py_files=','.join(spark_py_files),
+        conf=spark_committer_conf,
         name='airflow-distributed-test',
         verbose=True,
         retries=0
@@ -111,6 +135,8 @@ with DAG(
         application='/opt/spark/apps/nyc_taxi_silver_norm_to_eda.py',
         conn_id='spark_cluster',
         jars=','.join(spark_drivers),
+        py_files=','.join(spark_py_files),
+        conf=spark_committer_conf,
         name='airflow-distributed-test',
         verbose=True,
         retries=0
@@ -121,6 +147,7 @@ with DAG(
         application='/opt/spark/apps/nyc_taxi_agg_write_to_postgre.py',
         conn_id='spark_cluster',
         jars=','.join(spark_drivers),
+        py_files=','.join(spark_py_files),
         name='airflow-distributed-test',
         verbose=True,
         retries=0
@@ -141,13 +168,25 @@ dag.doc_md = """
 Этот DAG загружает данные NYC Taxi из публичного источника в MinIO.
 
 ### Задачи:
-1. **`remote_files_task`** - Получает список доступных файлов за год запуска DAG
-2. **`local_files_task`** - Получает список доступных файлов в хранилище
-3. **`download_nyc_taxi_data`** - Скачивает недостающие файлы в MinIO://bronze
-4. **`bronze_to_silver_norm`** - Нормализует файлы из слоя bronze и кладет в слой silver
-5. **`silver_norm_to_eda`** - Берет нормализованные данные из silver, чистит и обогощает
+1. **`remote_files_task`** - Получает список доступных файлов за год запуска DAG (с ETag и размером)
+2. **`local_files_task`** - Получает список файлов в хранилище из манифеста `bronze/nyc-taxi-data/_manifest.json`
+3. **`download_nyc_taxi_data`** - Скачивает недостающие и изменившиеся на сайте файлы в MinIO://bronze
+4. **`bronze_to_silver_norm`** - Нормализует все новые месяцы из слоя bronze одним Spark джобом и кладет в слой silver (`year=/month=`)
+5. **`silver_norm_to_eda`** - Берет нормализованные данные из silver, чистит и обогощает (`nyc-taxi-data-eda/year=/month=`)
 6. **`agg_write_to_postgres`** - Создает агрегаты, записывает результаты в БД Postgres
 
+### Публикация в silver:
+- Spark дописывает месяц новой версией `year=/month=/run=<run_id>/` через S3A magic коммиттер, прежняя версия не трогается
+- `_SUCCESS` месяца перезаписывается указателем на `run_id` - читатели переключаются на новую версию одной записью
+- Старые версии удаляются после переключения; версия без указателя не читается, повторный запуск пересчитывает месяц
+
+### Старая раскладка silver (`yellow_tripdata_YYYY-MM/`):
+- `agg_write_to_postgres` читает только опубликованные `year=/month=/run=` и без периода перезаписывает таблицу целиком
+- Поэтому `silver_norm_to_eda` не считает старые папки EDA обработанными и пересчитывает эти месяцы
+  в новую раскладку в том же запуске DAG, до агрегатов - история в таблице не теряется
+- Старые папки norm читаются как вход EDA до миграции; `silver_layout_migrate --apply` переносит norm
+  и удаляет старые папки EDA (запуск вручную, не обязателен для корректности DAG)
+
 
 ### Расписание:
 - Запускается ежемесячно (@monthly)
@@ -0,0 +1,170 @@
+# Асинхронный слой работы с Postgres на asyncpg.
+#
+# Нужен, когда из одной таски надо выполнить много независимых запросов
+# (обновление справочников, проверки качества данных): запросы идут
+# одновременно через общий пул, а не друг за другом.
+#
+# Из синхронного кода (таска Airflow, ноутбук без запущенного цикла):
+#
+# results = run_queries_concurrently({
+#     "rows":  "SELECT count(*) FROM nyc_taxi.nyc_taxi_agg_table",
+#     "zones": "SELECT count(DISTINCT pulocationid) FROM nyc_taxi.nyc_taxi_agg_table",
+# }, max_concurrency=8)
+# results["rows"]  -> pandas DataFrame
+#
+# Из асинхронного кода - gather_queries / gather_ddl напрямую.
+# Параметры запросов в стиле asyncpg: $1, $2 ... -> ("SELECT ... WHERE year = $1", 2025)
+
+import pandas as pd
+import asyncio
+import time
+
+import asyncpg
+
+# ------------------------------------------------------------------------------
+
+# Пулы привязаны к циклу событий, поэтому кешируются по (цикл, DSN)
+_pools = {}
+
+
+# Возвращает общий для текущего цикла событий пул соединений asyncpg для DSN
+async def get_pool(
+        host="postgres-db",
+        port=5432,
+        user="airflow",
+        password="airflow",
+        database="learn_base",
+        min_size=1,
+        max_size=10,):
+
+    dsn = f"postgresql://{user}:{password}@{host}:{port}/{database}"
+    key = (asyncio.get_running_loop(), dsn)
+
+    pool = _pools.get(key)
+    if pool is None:
+        pool = await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size)
+        _pools[key] = pool
+    return pool
+
+
+# Закрывает все пулы текущего цикла событий
+async def close_pools():
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _pools if key[0] is loop]:
+        await _pools.pop(key).close()
+
+# ------------------------------------------------------------------------------
+
+# Запрос или DDL задается строкой или кортежем (sql, *args)
+def _split_statement(statement):
+    if isinstance(statement, str):
+        return statement, ()
+    return statement[0], tuple(statement[1:])
+
+
+# Записи asyncpg -> pandas DataFrame (колонки сохраняются и для пустого результата)
+def records_to_df(records, columns=None):
+    if records:
+        return pd.DataFrame([tuple(record) for record in records], columns=list(records[0].keys()))
+    return pd.DataFrame(columns=columns or [])
+
+
+# Принимает запрос вида SELECT FROM
+# Получает результат запроса в Pandas DataFrame
+async def fetch_df(pool, query, *args):
+    async with pool.acquire() as connection:
+        statement = await connection.prepare(query)
+        records = await statement.fetch(*args)
+        columns = [attribute.name for attribute in statement.get_attributes()]
+    return records_to_df(records, columns)
+
+
+# Выполняет DDL скрипт (можно несколько команд через ;) в отдельной транзакции
+async def execute_ddl(pool, script, *args):
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            return await connection.execute(script, *args)
+
+# ------------------------------------------------------------------------------
+
+# Выполняет все statements через pool одновременно, не больше max_concurrency сразу
+# statements - dict {имя: запрос} или список запросов; результат той же формы
+# return_exceptions=True - ошибка одного запроса попадает в результат, остальные доработают
+async def _gather(pool, statements, runner, max_concurrency, return_exceptions):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    names = list(statements) if isinstance(statements, dict) else list(range(len(statements)))
+    items = [statements[name] for name in names]
+
+    async def run(name, statement):
+        query, args = _split_statement(statement)
+        async with semaphore:
+            start_time = time.time()
+            result = await runner(pool, query, *args)
+            print(f"  ✓ {name}: {time.time() - start_time:.2f} с")
+            return result
+
+    results = await asyncio.gather(
+        *(run(name, item) for name, item in zip(names, items)),
+        return_exceptions=return_exceptions,
+    )
+
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            print(f"  ✗ {name}: {result}")
+
+    return dict(zip(names, results)) if isinstance(statements, dict) else results
+
+
+async def gather_queries(pool, queries, max_concurrency=8, return_exceptions=False):
+    return await _gather(pool, queries, fetch_df, max_concurrency, return_exceptions)
+
+
+async def gather_ddl(pool, scripts, max_concurrency=8, return_exceptions=False):
+    return await _gather(pool, scripts, execute_ddl, max_concurrency, return_exceptions)
+
+# ------------------------------------------------------------------------------
+
+# Синхронные обертки: поднимают цикл событий и пул, выполняют, закрывают пул
+# Размер пула = max_concurrency, чтобы каждый одновременный запрос имел свое соединение
+def _run(gather, statements, max_concurrency, return_exceptions, connection):
+    async def main():
+        pool = await get_pool(max_size=max_concurrency, **connection)
+        try:
+            start_time = time.time()
+            results = await gather(pool, statements, max_concurrency, return_exceptions)
+            print(f"⏱️  Выполнено {len(statements)} запросов за {time.time() - start_time:.2f} секунд")
+            return results
+        finally:
+            await close_pools()
+
+    return asyncio.run(main())
+
+
+# Выполняет много SELECT запросов одновременно, возвращает их результаты в Pandas DataFrame
+def run_queries_concurrently(
+        queries,
+        max_concurrency=8,
+        return_exceptions=False,
+        host="postgres-db",
+        port=5432,
+        user="airflow",
+        password="airflow",
+        database="learn_base",):
+
+    connection = dict(host=host, port=port, user=user, password=password, database=database)
+    return _run(gather_queries, queries, max_concurrency, return_exceptions, connection)
+
+
+# Выполняет много независимых DDL скриптов одновременно, каждый в своей транзакции
+def run_ddl_concurrently(
+        scripts,
+        max_concurrency=8,
+        return_exceptions=False,
+        host="postgres-db",
+        port=5432,
+        user="airflow",
+        password="airflow",
+        database="learn_base",):
+
+    connection = dict(host=host, port=port, user=user, password=password, database=database)
+    return _run(gather_ddl, scripts, max_concurrency, return_exceptions, connection)
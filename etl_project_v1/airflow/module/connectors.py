@@ -1,28 +1,186 @@
 import psycopg2
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import threading
+import struct
+import io
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_HALF_EVEN, ROUND_HALF_UP, localcontext
 from sqlalchemy import create_engine, text
 
+from module.query_metrics import track_query, send_metric
+
+# ------------------------------------------------------------------------------
+
+# Engine на каждую строку подключения создается один раз и держит пул соединений
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+# Возвращает закешированный SQLAlchemy engine для DSN
+# Повторные вызовы с теми же параметрами переиспользуют пул соединений
+def get_engine(
+        host="postgres-db",
+        port=5432,
+        user="airflow",
+        password="airflow",
+        database="learn_base",
+        pool_size=5,
+        max_overflow=10,):
+
+    connection_string = f"postgresql://{user}:{password}@{host}:{port}/{database}"
+
+    with _engines_lock:
+        engine = _engines.get(connection_string)
+        if engine is None:
+            engine = create_engine(
+                connection_string,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_pre_ping=True,  # отбрасываем соединения, оборванные сервером
+            )
+            _engines[connection_string] = engine
+    return engine
+
+
+# Только чтение: SELECT / WITH без изменяющих данные команд, для остальных план не снимается
+READ_ONLY_QUERY = re.compile(r"^\s*(select|with)\b", re.I)
+WRITE_KEYWORDS = re.compile(r"\b(insert|update|delete|merge|truncate|create|drop|alter)\b", re.I)
+
+# Планирование не должно идти дольше этого времени
+EXPLAIN_TIMEOUT_MS = 10_000
+
+
+# Снимает план EXPLAIN запроса только на чтение (для журнала медленных запросов)
+# Без ANALYZE: запрос не выполняется повторно, только планируется
+def explain_query(
+        query,
+        params=None,
+        host="postgres-db",
+        port=5432,
+        user="airflow",
+        password="airflow",
+        database="learn_base",):
+
+    if not READ_ONLY_QUERY.match(query) or WRITE_KEYWORDS.search(query):
+        return None
+
+    engine = get_engine(host=host, port=port, user=user, password=password, database=database)
+
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            connection.execute(text(f"SET LOCAL statement_timeout = {EXPLAIN_TIMEOUT_MS}"))
+            rows = connection.execute(text(f"EXPLAIN {query}"), params or {}).fetchall()
+        finally:
+            transaction.rollback()
+
+    return "\n".join(row[0] for row in rows)
+
+# ------------------------------------------------------------------------------
+
+# Кеш запросов (module.query_cache, Redis) подключается лениво: без пакета redis
+# коннекторы работают как раньше, только без кеша
+
+# Сбрасывает кеш запросов по таблице после записи в нее
+def invalidate_query_cache(table):
+    try:
+        import redis
+        from module.query_cache import invalidate_tables
+    except ImportError:
+        return
+
+    try:
+        invalidate_tables(table)
+    except redis.RedisError as e:
+        print(f"⚠️ Не удалось сбросить кеш запросов для {table}: {e}")
+
 # ------------------------------------------------------------------------------
 
 # Принимает запрос вида SELECT FROM
 # Получает результат запроса в Pandas DataFrame
+#
+# cache=True - результат кешируется в Redis (Arrow IPC) на cache_ttl секунд (по умолчанию query_cache.CACHE_TTL)
+# Ключ - нормализованный запрос, params, база и версии таблиц из FROM / JOIN
+# (cache_tables - задать список таблиц явно). Сброс - query_cache.invalidate_tables(...)
+#
+# get_df_from_postgres("SELECT * FROM nyc_taxi.nyc_taxi_agg_table WHERE year = :year",
+#                      params={"year": 2025}, cache=True)
 def get_df_from_postgres(
         query="""SELECT 1 AS one""",
         host="postgres-db",
         port=5432,
         user="airflow",
         password="airflow",
-        database="learn_base",):
+        database="learn_base",
+        params=None,
+        cache=False,
+        cache_ttl=None,
+        cache_tables=None,):
 
-    connection_string = f"postgresql://{user}:{password}@{host}:{port}/{database}"
-    engine = create_engine(connection_string)
+    cache_key = None
+    if cache:
+        try:
+            import redis
+            from module import query_cache
+        except ImportError as e:
+            print(f"⚠️ Кеш запросов недоступен: {e}")
+            cache = False
 
-    with engine.connect() as connection:
-        df = pd.read_sql_query(text(query), connection)
+    if cache:
+        try:
+            cache_key = query_cache.make_cache_key(query, params=params, database=f"{host}:{port}/{database}",
+                                                   tables=cache_tables)
+            df = query_cache.get_cached(cache_key)
+        except redis.RedisError as e:
+            print(f"⚠️ Кеш запросов недоступен: {e}")
+            cache_key, df = None, None
+        send_metric("query.cache", 1, "c", {"result": "hit" if df is not None else "miss"})
+        if df is not None:
+            return df
+
+    connection_params = dict(host=host, port=port, user=user, password=password, database=database)
+    engine = get_engine(**connection_params)
+
+    with track_query("select", query, explain=lambda: explain_query(query, params, **connection_params)) as stats:
+        with engine.connect() as connection:
+            df = pd.read_sql_query(text(query), connection, params=params)
+        stats["rows"], stats["bytes"] = len(df), df.memory_usage(deep=True).sum()
+
+    if cache_key is not None:
+        query_cache.set_cached(cache_key, df, ttl=cache_ttl or query_cache.CACHE_TTL)
     return df
 
 # ------------------------------------------------------------------------------
 
+# Принимает запрос вида SELECT FROM
+# Отдает результат порциями по chunksize строк (генератор Pandas DataFrame)
+# Строки читаются серверным курсором - в памяти только текущая порция
+#
+# for df in get_df_chunks_from_postgres("SELECT * FROM nyc_taxi.nyc_taxi_agg_table"):
+#     ...
+def get_df_chunks_from_postgres(
+        query="""SELECT 1 AS one""",
+        chunksize=100_000,
+        host="postgres-db",
+        port=5432,
+        user="airflow",
+        password="airflow",
+        database="learn_base",):
+
+    engine = get_engine(host=host, port=port, user=user, password=password, database=database)
+
+    # stream_results=True - psycopg2 открывает именованный (серверный) курсор
+    with engine.connect().execution_options(stream_results=True) as connection:
+        for chunk in pd.read_sql_query(text(query), connection, chunksize=chunksize):
+            yield chunk
+
+# ------------------------------------------------------------------------------
+
 # Принимает первым параметром DLL скрипт
 # Выполняет его в базе данных
 def ddl_on_postgres(
@@ -33,13 +191,615 @@ def ddl_on_postgres(
         password="airflow",
         database="learn_base",):
 
-    with psycopg2.connect(host=host, port=port,
-                          database=database, user=user,
-                          password=password) as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(query)
-        conn.commit()
+    with track_query("ddl", query) as stats:
+        with psycopg2.connect(host=host, port=port,
+                              database=database, user=user,
+                              password=password) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                stats["rows"] = max(cursor.rowcount, 0)
+            conn.commit()
 
     print("DDL скрипт выполнен успешно")
 
 
+
+# ------------------------------------------------------------------------------
+
+# Соответствие типов pandas / pyarrow типам Postgres при создании таблицы
+PG_TYPES = {
+    "int8": "SMALLINT",
+    "uint8": "SMALLINT",
+    "int16": "SMALLINT",
+    "uint16": "INTEGER",
+    "int32": "INTEGER",
+    "uint32": "BIGINT",
+    "int64": "BIGINT",
+    "float32": "REAL",
+    "float64": "DOUBLE PRECISION",
+    "bool": "BOOLEAN",
+    "datetime64[ns]": "TIMESTAMP",
+    "date": "DATE",
+}
+
+# Начало отсчета дат и времени в бинарном формате COPY
+PG_EPOCH = pd.Timestamp("2000-01-01")
+PG_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+
+# Возвращает тип колонки Postgres для dtype pandas или типа pyarrow (строки и все прочее - TEXT)
+def get_pg_type(dtype):
+    if isinstance(dtype, pa.DataType):
+        if pa.types.is_timestamp(dtype):
+            return "TIMESTAMP"
+        if pa.types.is_date(dtype):
+            return "DATE"
+        if pa.types.is_boolean(dtype):
+            return "BOOLEAN"
+        if pa.types.is_integer(dtype) or pa.types.is_floating(dtype):
+            return PG_TYPES.get(str(dtype.to_pandas_dtype().__name__), "TEXT")
+        return "TEXT"
+
+    name = str(dtype).lower()
+    if name.startswith("datetime64"):
+        return "TIMESTAMP"
+    return PG_TYPES.get(name, "TEXT")
+
+
+# Порции DataFrame по chunksize строк из DataFrame или pyarrow.Table
+def iter_df_chunks(data, chunksize):
+    if isinstance(data, pd.DataFrame):
+        for start in range(0, len(data), chunksize):
+            yield data.iloc[start:start + chunksize]
+    else:
+        for batch in data.to_batches(max_chunksize=chunksize):
+            yield batch.to_pandas()
+
+
+# Тип numpy (big-endian) значения в бинарном формате COPY для типов фиксированной длины
+# TIMESTAMP - микросекунды от PG_EPOCH, DATE - дни от PG_EPOCH
+PG_BINARY_DTYPES = {
+    "SMALLINT": ">i2",
+    "INTEGER": ">i4",
+    "BIGINT": ">i8",
+    "REAL": ">f4",
+    "DOUBLE PRECISION": ">f8",
+    "BOOLEAN": "?",
+    "TIMESTAMP": ">i8",
+    "DATE": ">i4",
+}
+
+
+# Значения колонки в numpy массиве типа PG_BINARY_DTYPES[pg_type] (на месте NULL - 0)
+def _binary_column_values(column, pg_type, nulls):
+    if pg_type in ("TIMESTAMP", "DATE"):
+        timestamps = pd.to_datetime(column)
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_convert(None)
+        unit = pd.Timedelta(days=1) if pg_type == "DATE" else pd.Timedelta(microseconds=1)
+        values = ((timestamps - PG_EPOCH) // unit).fillna(0).astype("int64")
+    elif pg_type == "BOOLEAN":
+        values = column.where(~nulls, False).astype(bool)
+    elif pg_type in ("REAL", "DOUBLE PRECISION"):
+        values = column.astype("float64")
+    else:
+        values = column.where(~nulls, 0).astype("int64")
+    return values.to_numpy().astype(PG_BINARY_DTYPES[pg_type])
+
+
+# Строки колонки в UTF-8: (смещения строк, байты всех строк подряд), NULL - пустая строка
+def _text_column_bytes(column, nulls):
+    texts = column.where(~nulls, "")
+    try:
+        array = pa.array(texts, type=pa.large_string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        array = pa.array(texts.astype(str), type=pa.large_string())
+
+    offsets = np.frombuffer(array.buffers()[1], dtype=np.int64)[array.offset:array.offset + len(array) + 1]
+    data = array.buffers()[2]
+    data = np.frombuffer(data, dtype=np.uint8) if data is not None else np.empty(0, dtype=np.uint8)
+    return offsets, data
+
+
+# Кодирует порцию DataFrame в бинарный формат COPY (заголовок, строки, трейлер)
+# Типы колонок таблицы должны совпадать с pg_types - сервер не приводит бинарные значения
+#
+# Кодирование по колонкам, без цикла Python по ячейкам: для каждой колонки
+# считается длина поля в каждой строке, по ним - смещение поля в буфере,
+# и байты всей колонки раскладываются в буфер одной операцией numpy
+def encode_binary_copy(df, pg_types):
+    header = PG_COPY_SIGNATURE + struct.pack("!ii", 0, 0)
+    rows = len(df)
+
+    columns = []
+    row_sizes = np.full(rows, 2, dtype=np.int64)
+    for index, pg_type in enumerate(pg_types):
+        column = df.iloc[:, index]
+        nulls = column.isna().to_numpy()
+
+        if pg_type in PG_BINARY_DTYPES:
+            values = _binary_column_values(column, pg_type, nulls)
+            value_sizes = np.where(nulls, 0, values.dtype.itemsize)
+        else:
+            values = _text_column_bytes(column, nulls)
+            value_sizes = np.diff(values[0])
+
+        columns.append((pg_type, nulls, values, value_sizes))
+        row_sizes += 4 + value_sizes
+
+    buffer = np.empty(len(header) + int(row_sizes.sum()) + 2, dtype=np.uint8)
+    buffer[:len(header)] = np.frombuffer(header, dtype=np.uint8)
+    buffer[-2:] = np.frombuffer(struct.pack("!h", -1), dtype=np.uint8)
+
+    positions = len(header) + np.cumsum(row_sizes) - row_sizes
+    buffer[positions[:, None] + np.arange(2)] = np.frombuffer(struct.pack("!h", len(pg_types)), dtype=np.uint8)
+    positions += 2
+
+    for pg_type, nulls, values, value_sizes in columns:
+        # Длина поля, -1 - NULL
+        lengths = np.where(nulls, -1, value_sizes).astype(">i4").view(np.uint8).reshape(-1, 4)
+        buffer[positions[:, None] + np.arange(4)] = lengths
+        starts = positions + 4
+
+        if pg_type in PG_BINARY_DTYPES:
+            width = values.dtype.itemsize
+            valid = ~nulls
+            buffer[starts[valid][:, None] + np.arange(width)] = values.view(np.uint8).reshape(-1, width)[valid]
+        else:
+            offsets, data = values
+            targets = np.repeat(starts - offsets[:-1], value_sizes) + np.arange(offsets[0], offsets[-1])
+            buffer[targets] = data[offsets[0]:offsets[-1]]
+
+        positions = starts + value_sizes
+
+    return io.BytesIO(buffer.tobytes())
+
+
+# Кодирует порцию DataFrame в CSV для COPY (NaN / None -> NULL)
+def encode_csv_copy(df):
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    return buffer
+
+
+# Имена колонок и типы Postgres для pandas DataFrame или pyarrow.Table
+def get_columns_and_pg_types(data):
+    if isinstance(data, pd.DataFrame):
+        return list(data.columns), [get_pg_type(dtype) for dtype in data.dtypes]
+    return data.schema.names, [get_pg_type(field.type) for field in data.schema]
+
+
+# Пишет данные порциями через COPY FROM STDIN в открытом курсоре
+# Возвращает (число строк, число переданных байт)
+def _copy_chunks(cursor, data, table, columns, pg_types, copy_format, chunksize):
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    copy_sql = f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT {copy_format})"
+
+    rows = 0
+    nbytes = 0
+    for chunk in iter_df_chunks(data, chunksize):
+        if copy_format == "csv":
+            buffer = encode_csv_copy(chunk)
+        else:
+            buffer = encode_binary_copy(chunk, pg_types)
+        nbytes += buffer.seek(0, io.SEEK_END)
+        buffer.seek(0)
+        cursor.copy_expert(copy_sql, buffer)
+        rows += len(chunk)
+    return rows, nbytes
+
+# ------------------------------------------------------------------------------
+
+# Быстрая загрузка pandas DataFrame или pyarrow.Table в таблицу через COPY FROM STDIN
+# Данные идут порциями по chunksize строк, все порции - в одной транзакции
+#
+# copy_to_postgres(df, "nyc_taxi.my_table", create_table=True)
+# copy_to_postgres(arrow_table, "nyc_taxi.my_table", copy_format="binary", if_exists="truncate")
+#
+# copy_format: "csv" или "binary"
+# if_exists:   "append" - дописать, "truncate" - очистить таблицу перед загрузкой,
+#              "replace" - пересоздать таблицу по типам данных
+def copy_to_postgres(
+        data,
+        table,
+        copy_format="csv",
+        create_table=False,
+        if_exists="append",
+        chunksize=500_000,
+        host="postgres-db",
+        port=5432,
+        user="airflow",
+        password="airflow",
+        database="learn_base",):
+
+    if copy_format not in ("csv", "binary"):
+        raise ValueError(f"Неизвестный формат COPY: {copy_format}. Доступны: csv, binary")
+
+    columns, pg_types = get_columns_and_pg_types(data)
+
+    with track_query("copy", f"COPY {table} FROM STDIN WITH (FORMAT {copy_format})") as stats:
+        with psycopg2.connect(host=host, port=port,
+                              database=database, user=user,
+                              password=password) as conn:
+            with conn.cursor() as cursor:
+                if if_exists == "replace":
+                    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+                if create_table or if_exists == "replace":
+                    columns_ddl = ", ".join(f'"{column}" {pg_type}' for column, pg_type in zip(columns, pg_types))
+                    cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns_ddl})")
+
+                if if_exists == "truncate":
+                    cursor.execute(f"TRUNCATE TABLE {table}")
+
+                rows, stats["bytes"] = _copy_chunks(cursor, data, table, columns, pg_types, copy_format, chunksize)
+                stats["rows"] = rows
+
+            conn.commit()
+
+    print(f"COPY в {table} выполнен успешно: {rows} строк")
+
+    # Таблица изменилась - закешированные по ней результаты запросов больше не актуальны
+    if rows or if_exists in ("truncate", "replace"):
+        invalidate_query_cache(table)
+    return rows
+
+# ------------------------------------------------------------------------------
+
+# Инкрементальная загрузка (upsert) pandas DataFrame или pyarrow.Table по ключам
+#
+# В одной транзакции:
+#   1. COPY во временную таблицу (TEMP - не пишется в WAL, удаляется на COMMIT)
+#      со структурой целевой таблицы
+#   2. INSERT ... ON CONFLICT (keys) DO UPDATE из временной таблицы в целевую
+# Обновляются только строки, у которых изменилось хоть одно значение, поэтому
+# повторная загрузка того же месяца почти ничего не пишет.
+# Дубли ключей внутри data схлопываются - побеждает последняя строка.
+#
+# На keys в целевой таблице должен быть PRIMARY KEY или UNIQUE индекс.
+# update_columns - какие колонки обновлять (по умолчанию все колонки data кроме keys),
+# пустой список - только вставка новых строк (DO NOTHING).
+#
+# result = upsert_to_postgres(df, "nyc_taxi.nyc_taxi_agg_table",
+#                             keys=["date_month", "day_of_week", "time_of_day", "pulocationid"])
+# {"staged": 1200, "inserted": 40, "updated": 15, "unchanged": 1145}
+def upsert_to_postgres(
+        data,
+        table,
+        keys,
+        update_columns=None,
+        copy_format="csv",
+        chunksize=500_000,
+        host="postgres-db",
+        port=5432,
+        user="airflow",
+        password="airflow",
+        database="learn_base",):
+
+    if copy_format not in ("csv", "binary"):
+        raise ValueError(f"Неизвестный формат COPY: {copy_format}. Доступны: csv, binary")
+
+    columns, pg_types = get_columns_and_pg_types(data)
+
+    missing_keys = [key for key in keys if key not in columns]
+    if missing_keys:
+        raise ValueError(f"Ключевые колонки отсутствуют в данных: {missing_keys}")
+
+    if update_columns is None:
+        update_columns = [column for column in columns if column not in keys]
+
+    staging = f"upsert_staging_{os.getpid()}_{threading.get_ident()}"
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    key_list = ", ".join(f'"{key}"' for key in keys)
+
+    if update_columns:
+        set_list = ", ".join(f'"{column}" = EXCLUDED."{column}"' for column in update_columns)
+        target_values = ", ".join(f'target."{column}"' for column in update_columns)
+        new_values = ", ".join(f'EXCLUDED."{column}"' for column in update_columns)
+        conflict_action = (f"DO UPDATE SET {set_list} "
+                           f"WHERE ({target_values}) IS DISTINCT FROM ({new_values})")
+    else:
+        conflict_action = "DO NOTHING"
+
+    # xmax = 0 у только что вставленной строки, у обновленной - id текущей транзакции
+    upsert_sql = f"""
+        WITH upserted AS (
+            INSERT INTO {table} AS target ({column_list})
+            SELECT DISTINCT ON ({key_list}) {column_list}
+            FROM {staging}
+            ORDER BY {key_list}, ctid DESC
+            ON CONFLICT ({key_list}) {conflict_action}
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT
+            count(*) FILTER (WHERE inserted),
+            count(*) FILTER (WHERE NOT inserted)
+        FROM upserted
+    """
+
+    with track_query("upsert", upsert_sql) as stats:
+        with psycopg2.connect(host=host, port=port,
+                              database=database, user=user,
+                              password=password) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+                staged, stats["bytes"] = _copy_chunks(cursor, data, staging, columns, pg_types, copy_format, chunksize)
+                stats["rows"] = staged
+
+                cursor.execute(f"ANALYZE {staging}")
+                cursor.execute(upsert_sql)
+                inserted, updated = cursor.fetchone()
+
+            conn.commit()
+
+    result = {
+        "staged": staged,
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": staged - inserted - updated,
+    }
+    print(f"Upsert в {table} выполнен успешно: вставлено {inserted}, обновлено {updated}, "
+          f"без изменений {result['unchanged']} (из {staged} строк)")
+
+    # Таблица изменилась - закешированные по ней результаты запросов больше не актуальны
+    if inserted or updated:
+        invalidate_query_cache(table)
+
+    return result
+
+# ------------------------------------------------------------------------------
+
+# OID типов Postgres -> типы pyarrow для чтения результата COPY
+PG_OID_ARROW_TYPES = {
+    16: pa.bool_(),                 # boolean
+    20: pa.int64(),                 # bigint
+    21: pa.int16(),                 # smallint
+    23: pa.int32(),                 # integer
+    700: pa.float32(),              # real
+    701: pa.float64(),              # double precision
+    1082: pa.date32(),              # date
+    1114: pa.timestamp("us"),       # timestamp
+    1184: pa.timestamp("us", tz="UTC"),  # timestamptz
+}
+
+# Текстовые типы: text, varchar, bpchar, name
+PG_TEXT_OIDS = {25, 1043, 1042, 19}
+PG_NUMERIC_OID = 1700
+PG_TIMESTAMPTZ_OID = 1184
+
+
+# Возвращает тип pyarrow для колонки из cursor.description
+# numeric(p, s) -> decimal128(p, s); numeric без точности -> float64
+def get_arrow_type(column, dictionary_strings=True):
+    if column.type_code == PG_NUMERIC_OID:
+        if column.precision and 0 < column.precision <= 38:
+            return pa.decimal128(column.precision, column.scale or 0)
+        return pa.float64()
+    if column.type_code in PG_OID_ARROW_TYPES:
+        return PG_OID_ARROW_TYPES[column.type_code]
+    if column.type_code in PG_TEXT_OIDS and dictionary_strings:
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+# ------------------------------------------------------------------------------
+
+# Принимает запрос вида SELECT FROM
+# Получает результат запроса сразу в pyarrow.Table, минуя pandas и SQLAlchemy
+#
+# Данные идут через COPY (query) TO STDOUT в CSV и разбираются pyarrow по точным
+# типам из описания запроса: целые нужной ширины, numeric(p, s) -> decimal,
+# строки - словарные (dictionary_strings=True), поэтому повторяющиеся значения
+# (borough, zone, жанры) хранятся один раз.
+# CSV передается через pipe, целиком в памяти не собирается.
+def get_arrow_from_postgres(
+        query="""SELECT 1 AS one""",
+        dictionary_strings=True,
+        host="postgres-db",
+        port=5432,
+        user="airflow",
+        password="airflow",
+        database="learn_base",):
+
+    import pyarrow.csv as pa_csv
+
+    connection_params = dict(host=host, port=port, user=user, password=password, database=database)
+    engine = get_engine(**connection_params)
+    conn = engine.raw_connection()
+
+    with track_query("arrow", query, explain=lambda: explain_query(query, **connection_params)) as stats:
+        try:
+            with conn.cursor() as cursor:
+                # Описание колонок без выполнения самого запроса
+                cursor.execute(f"SELECT * FROM ({query}) AS q LIMIT 0")
+                description = cursor.description
+
+            names = [column.name for column in description]
+            column_types = {column.name: get_arrow_type(column, dictionary_strings) for column in description}
+
+            # timestamptz выводим в UTC в ISO 8601 с Z - так его без догадок разбирает pyarrow
+            projection = ", ".join(
+                f"""to_char(q."{column.name}" AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"') AS "{column.name}\""""
+                if column.type_code == PG_TIMESTAMPTZ_OID else f'q."{column.name}"'
+                for column in description
+            )
+            copy_sql = f"COPY (SELECT {projection} FROM ({query}) AS q) TO STDOUT WITH (FORMAT csv)"
+
+            read_fd, write_fd = os.pipe()
+            errors = []
+
+            def run_copy():
+                try:
+                    with os.fdopen(write_fd, "wb") as writer, conn.cursor() as copy_cursor:
+                        copy_cursor.copy_expert(copy_sql, writer)
+                except Exception as e:
+                    errors.append(e)
+
+            copy_thread = threading.Thread(target=run_copy, daemon=True)
+            copy_thread.start()
+
+            read_error = None
+            try:
+                with os.fdopen(read_fd, "rb") as reader:
+                    # Пустой CSV (0 строк) pyarrow не читает - возвращаем пустую таблицу со схемой
+                    if not reader.peek(1):
+                        table = pa.schema(list(column_types.items())).empty_table()
+                    else:
+                        table = pa_csv.read_csv(
+                            reader,
+                            read_options=pa_csv.ReadOptions(column_names=names),
+                            convert_options=pa_csv.ConvertOptions(
+                                column_types=column_types,
+                                true_values=["t"],                 # boolean в COPY выводится как t / f
+                                false_values=["f"],
+                                strings_can_be_null=True,          # пустое без кавычек - NULL
+                                quoted_strings_can_be_null=False,  # "" - пустая строка
+                            ),
+                        )
+            except Exception as e:
+                read_error = e
+            finally:
+                copy_thread.join()
+
+            # Ошибка Postgres важнее ошибки разбора: при упавшем COPY reader видит обрезанный CSV.
+            # BrokenPipeError в COPY - следствие того, что упал и закрыл pipe сам reader
+            if errors and not (read_error is not None and isinstance(errors[0], BrokenPipeError)):
+                raise errors[0]
+            if read_error is not None:
+                raise read_error
+            conn.commit()
+        finally:
+            conn.close()
+
+        stats["rows"], stats["bytes"] = table.num_rows, table.nbytes
+
+    return table
+
+# ------------------------------------------------------------------------------
+
+# pyarrow.Table -> pandas DataFrame с минимумом копирования
+# Словарные строки становятся category, колонки освобождаются по мере конвертации
+# (после вызова исходная table больше не пригодна)
+def arrow_to_pandas(table):
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+# pyarrow.Table -> Spark DataFrame
+# Spark 3.5 не принимает pyarrow.Table напрямую, поэтому передача идет через pandas
+# с включенным Arrow: данные уходят в JVM Arrow батчами, без построчной сериализации
+def arrow_to_spark(spark, table):
+    spark.conf.set("spark.sql.execution.arrow.pyspark.enabled", "true")
+    return spark.createDataFrame(table.to_pandas(split_blocks=True, self_destruct=True))
+
+# ------------------------------------------------------------------------------
+
+# Переводит границу партиционирования в целое число, как это делает Spark JDBC:
+# date -> дни от 1970-01-01, datetime -> микросекунды от эпохи, число -> как есть
+def _bound_to_long(value):
+    if isinstance(value, datetime):
+        return (value - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+    if isinstance(value, date):
+        return (value - date(1970, 1, 1)).days
+    return int(value)
+
+
+# Обратное преобразование в SQL литерал для WHERE
+def _long_to_literal(value, kind):
+    if kind is datetime:
+        return f"'{(datetime(1970, 1, 1) + timedelta(microseconds=value)).isoformat(sep=' ')}'"
+    if kind is date:
+        return f"'{(date(1970, 1, 1) + timedelta(days=value)).isoformat()}'"
+    return str(value)
+
+
+# Условия WHERE для каждой партиции - та же логика, что у Spark JDBC
+# (partitionColumn / lowerBound / upperBound / numPartitions, JDBCRelation.columnPartition):
+# границы не фильтруют данные, первая партиция забирает все < 2-й границы и NULL,
+# последняя - все >= последней границы
+def get_partition_predicates(column, lower_bound, upper_bound, num_partitions):
+    kind = datetime if isinstance(lower_bound, datetime) else date if isinstance(lower_bound, date) else int
+    lower = _bound_to_long(lower_bound)
+    upper = _bound_to_long(upper_bound)
+
+    if lower > upper:
+        raise ValueError(f"lower_bound ({lower_bound}) больше upper_bound ({upper_bound})")
+    if num_partitions <= 1 or lower == upper:
+        return [None]
+
+    # Партиций не может быть больше, чем значений в диапазоне
+    if upper - lower < num_partitions:
+        num_partitions = upper - lower
+
+    # 18 знаков после запятой у границ в микросекундах (~1.7e15) не помещаются
+    # в точность контекста по умолчанию (28 знаков) - quantize падает с InvalidOperation
+    with localcontext() as context:
+        context.prec = 60
+        upper_stride = (Decimal(upper) / Decimal(num_partitions)).quantize(Decimal("1e-18"), rounding=ROUND_HALF_EVEN)
+        lower_stride = (Decimal(lower) / Decimal(num_partitions)).quantize(Decimal("1e-18"), rounding=ROUND_HALF_EVEN)
+        precise_stride = upper_stride - lower_stride
+        stride = int(precise_stride)
+
+        # Часть шагов, недостающих последней партиции, делится пополам между первой и последней
+        lost_strides = (precise_stride - stride) * num_partitions / stride
+        current = lower + int(((lost_strides / 2) * stride).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+    predicates = []
+    for i in range(num_partitions):
+        lower_clause = f"{column} >= {_long_to_literal(current, kind)}" if i != 0 else None
+        current += stride
+        upper_clause = f"{column} < {_long_to_literal(current, kind)}" if i != num_partitions - 1 else None
+
+        if upper_clause is None:
+            predicates.append(lower_clause)
+        elif lower_clause is None:
+            predicates.append(f"{upper_clause} or {column} is null")
+        else:
+            predicates.append(f"{lower_clause} AND {upper_clause}")
+    return predicates
+
+# ------------------------------------------------------------------------------
+
+# Принимает запрос вида SELECT FROM
+# Читает большой результат параллельно: запрос режется по диапазону partition_column
+# (число или дата) на num_partitions срезов, срезы читаются одновременно
+# через пул соединений и склеиваются
+#
+# Разбиение совпадает со spark.read.jdbc(partitionColumn, lowerBound, upperBound, numPartitions),
+# поэтому срезы одинаковы при чтении из pandas и из Spark
+#
+# df = get_df_partitioned_from_postgres(
+#     "SELECT * FROM nyc_taxi.nyc_taxi_agg_table",
+#     partition_column="pulocationid", lower_bound=1, upper_bound=265, num_partitions=8)
+def get_df_partitioned_from_postgres(
+        query="""SELECT 1 AS one""",
+        partition_column="one",
+        lower_bound=0,
+        upper_bound=1,
+        num_partitions=4,
+        as_arrow=False,
+        max_workers=None,
+        host="postgres-db",
+        port=5432,
+        user="airflow",
+        password="airflow",
+        database="learn_base",):
+
+    predicates = get_partition_predicates(partition_column, lower_bound, upper_bound, num_partitions)
+    queries = [
+        f"SELECT * FROM ({query}) AS q" + (f" WHERE {predicate}" if predicate else "")
+        for predicate in predicates
+    ]
+
+    connection = dict(host=host, port=port, user=user, password=password, database=database)
+    reader = get_arrow_from_postgres if as_arrow else get_df_from_postgres
+
+    # Срезы читаются через общий пул engine: одновременно не больше pool_size соединений,
+    # остальные срезы ждут свободный поток (max_workers - явный предел)
+    pool_size = get_engine(**connection).pool.size()
+    workers = min(len(queries), max_workers or pool_size)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        parts = list(executor.map(lambda partition_query: reader(query=partition_query, **connection), queries))
+
+    if as_arrow:
+        return pa.concat_tables(parts)
+    return pd.concat(parts, ignore_index=True)
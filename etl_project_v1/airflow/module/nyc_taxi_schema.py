@@ -0,0 +1,235 @@
+# Реестр схем сырых файлов NYC TLC, версионированный по датасету и году.
+# Имена колонок в нижнем регистре (в исходниках встречается и VendorID, и Airport_fee).
+# Типы логические: 'int', 'double', 'timestamp', 'string' - ширина (int32/int64) не важна.
+#
+# Airflow:  from module.nyc_taxi_schema import validate_columns
+# Spark:    from nyc_taxi_schema import compile_projection
+#           (файл передается в spark-submit через --py-files /opt/airflow/module/nyc_taxi_schema.py)
+#
+# Новая колонка или датасет добавляются только здесь: нормализация в Spark
+# (compile_projection) и проверка файлов при загрузке (validate_columns)
+# берут схему из реестра.
+
+import re
+
+YELLOW_TRIPDATA_SCHEMA = {
+    "vendorid": "int",
+    "tpep_pickup_datetime": "timestamp",
+    "tpep_dropoff_datetime": "timestamp",
+    "passenger_count": "int",
+    "trip_distance": "double",
+    "ratecodeid": "int",
+    "store_and_fwd_flag": "string",
+    "pulocationid": "int",
+    "dolocationid": "int",
+    "payment_type": "int",
+    "fare_amount": "double",
+    "extra": "double",
+    "mta_tax": "double",
+    "tip_amount": "double",
+    "tolls_amount": "double",
+    "improvement_surcharge": "double",
+    "total_amount": "double",
+    "congestion_surcharge": "double",
+    "airport_fee": "double",
+    "cbd_congestion_fee": "double",
+}
+
+# Колонки, появившиеся не с первого года публикации
+YELLOW_TRIPDATA_OPTIONAL = {"congestion_surcharge", "airport_fee", "cbd_congestion_fee"}
+
+# Версии схемы: с какого года какие колонки обязательны
+# Порядок колонок в версии - порядок колонок в нормализованном файле
+YELLOW_TRIPDATA_VERSIONS = [
+    {"version": 1, "since": 2009,
+     "columns": [name for name in YELLOW_TRIPDATA_SCHEMA if name not in YELLOW_TRIPDATA_OPTIONAL]},
+    {"version": 2, "since": 2019,  # сбор за въезд в Манхэттен (congestion surcharge)
+     "columns": [name for name in YELLOW_TRIPDATA_SCHEMA if name not in {"airport_fee", "cbd_congestion_fee"}]},
+    {"version": 3, "since": 2022,  # сбор аэропортов
+     "columns": [name for name in YELLOW_TRIPDATA_SCHEMA if name != "cbd_congestion_fee"]},
+    {"version": 4, "since": 2025,  # сбор зоны CBD
+     "columns": list(YELLOW_TRIPDATA_SCHEMA)},
+]
+
+# Значение вместо NULL и отсутствующей колонки; для timestamp / string - NULL
+TYPE_DEFAULTS = {"int": 0, "double": 0.0}
+
+# Датасет -> (схема, необязательные колонки)
+DATASET_SCHEMAS = {
+    "yellow_tripdata": (YELLOW_TRIPDATA_SCHEMA, YELLOW_TRIPDATA_OPTIONAL),
+}
+
+# Датасет -> версии схемы по годам
+SCHEMA_VERSIONS = {
+    "yellow_tripdata": YELLOW_TRIPDATA_VERSIONS,
+}
+
+
+def get_dataset_name(filename):
+    """yellow_tripdata_2025-01.parquet -> yellow_tripdata"""
+    name = filename.rstrip("/").split("/")[-1]
+    return name.split("=", 1)[-1].rsplit("_", 1)[0]
+
+
+def get_dataset_year(filename):
+    """yellow_tripdata_2025-01.parquet -> 2025 (None, если года в имени нет)"""
+    match = re.search(r"(\d{4})-\d{2}", filename)
+    return int(match.group(1)) if match else None
+
+
+def get_schema_version(dataset, year=None):
+    """
+    Версия схемы датасета, действующая в году year.
+
+    year=None - последняя версия. None, если схемы для датасета нет.
+    """
+    versions = SCHEMA_VERSIONS.get(dataset)
+    if not versions:
+        return None
+    if year is None:
+        return versions[-1]
+
+    current = versions[0]
+    for version in versions:
+        if version["since"] <= year:
+            current = version
+    return current
+
+
+def validate_columns(dataset, columns, year=None):
+    """
+    Сверяет фактические колонки файла с ожидаемой схемой датасета.
+
+    columns - {имя колонки: логический тип}.
+    year - год файла: обязательными считаются колонки версии схемы этого года;
+    без year обязательны все колонки кроме YELLOW_TRIPDATA_OPTIONAL и подобных.
+    Статус: 'ok' - все совпало, 'drift' - новые колонки или сменился тип,
+    'invalid' - нет обязательных колонок, 'unknown' - схемы для датасета нет.
+    """
+    if dataset not in DATASET_SCHEMAS:
+        return {"status": "unknown"}
+
+    expected, optional = DATASET_SCHEMAS[dataset]
+    actual = {name.lower(): kind for name, kind in columns.items()}
+
+    if year is not None:
+        version = get_schema_version(dataset, year)
+        required = set(version["columns"])
+    else:
+        version = None
+        required = set(expected) - optional
+
+    missing_columns = sorted(required - set(actual))
+    unexpected_columns = sorted(set(actual) - set(expected))
+    type_changes = {
+        name: {"expected": expected[name], "actual": kind}
+        for name, kind in actual.items()
+        if name in expected and kind != expected[name]
+    }
+
+    if missing_columns:
+        status = "invalid"
+    elif unexpected_columns or type_changes:
+        status = "drift"
+    else:
+        status = "ok"
+
+    return {
+        "status": status,
+        "schema_version": version["version"] if version else None,
+        "missing_columns": missing_columns,
+        "unexpected_columns": unexpected_columns,
+        "type_changes": type_changes,
+    }
+
+# ------------------------------------------------------------------------------
+# Компиляция схемы в проекцию Spark
+
+SPARK_TYPES = {
+    "int": "int",
+    "double": "double",
+    "timestamp": "timestamp",
+    "string": "string",
+}
+
+
+def get_spark_logical_type(data_type):
+    """Приводит тип Spark к логическому типу схемы: int / double / timestamp / string"""
+    name = data_type.simpleString()
+    if name in ("tinyint", "smallint", "int", "bigint"):
+        return "int"
+    if name in ("float", "double") or name.startswith("decimal"):
+        return "double"
+    if name in ("timestamp", "timestamp_ntz", "date"):
+        return "timestamp"
+    if name == "string":
+        return "string"
+    return name
+
+
+def compile_projection(dataset, year, df_schema, all_columns=False):
+    """
+    Собирает нормализацию DataFrame в одну проекцию для df.select(...).
+
+    Вместо цепочки withColumnRenamed / withColumn (по узлу плана на колонку)
+    каждая колонка схемы - одно выражение: исходная колонка в любом регистре,
+    приведенная к типу схемы, NULL заменен значением по умолчанию, имя в
+    нижнем регистре. Колонки, которых нет в файле, - литерал по умолчанию.
+
+    Какие колонки попадают в результат:
+        - колонки версии схемы для year
+        - колонки схемы, которые есть в файле (даже если в этой версии их еще нет)
+        - all_columns=True - все колонки схемы: месяцы разных лет
+          получают одинаковую схему и объединяются через unionByName
+
+    Возвращает (columns, report). report - отчет о расхождениях с реестром:
+        unmapped_columns - колонки файла, которых нет в реестре (в результат не попадают)
+        missing_columns  - колонки версии, которых нет в файле (заполнены по умолчанию)
+        reconciled_types - {колонка: {"actual", "expected"}} приведенные типы
+    """
+    from pyspark.sql import functions as F
+
+    version = get_schema_version(dataset, year)
+    if version is None:
+        raise ValueError(f"Схема для датасета {dataset} не зарегистрирована в nyc_taxi_schema")
+
+    expected, _ = DATASET_SCHEMAS[dataset]
+
+    # Первое вхождение имени без учета регистра
+    source_columns = {}
+    for field in df_schema.fields:
+        source_columns.setdefault(field.name.lower(), field)
+
+    if all_columns:
+        output_names = list(expected)
+    else:
+        output_names = [name for name in expected if name in version["columns"] or name in source_columns]
+
+    columns = []
+    reconciled_types = {}
+    for name in output_names:
+        kind = expected[name]
+        default = F.lit(TYPE_DEFAULTS.get(kind)).cast(SPARK_TYPES[kind])
+        field = source_columns.get(name)
+
+        if field is None:
+            columns.append(default.alias(name))
+            continue
+
+        actual_kind = get_spark_logical_type(field.dataType)
+        if actual_kind != kind:
+            reconciled_types[name] = {"actual": field.dataType.simpleString(), "expected": kind}
+
+        column = F.col(f"`{field.name}`").cast(SPARK_TYPES[kind])
+        if kind in TYPE_DEFAULTS:
+            column = F.coalesce(column, default)
+        columns.append(column.alias(name))
+
+    report = {
+        "dataset": dataset,
+        "schema_version": version["version"],
+        "unmapped_columns": sorted(field.name for name, field in source_columns.items() if name not in expected),
+        "missing_columns": [name for name in version["columns"] if name not in source_columns],
+        "reconciled_types": reconciled_types,
+    }
+    return columns, report
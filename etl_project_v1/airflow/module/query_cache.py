@@ -0,0 +1,149 @@
+# Кеш результатов SQL запросов в Redis.
+#
+# Результат хранится как Arrow IPC (zstd) под ключом от нормализованного запроса,
+# параметров и версий таблиц, из которых он читает. Инвалидация - явная:
+# invalidate_tables("nyc_taxi.nyc_taxi_agg_table") увеличивает версию таблицы,
+# и все закешированные по ней результаты перестают находиться (и доживают свой TTL).
+#
+# Airflow / Jupyter: from module.query_cache import invalidate_tables
+# Spark:             from query_cache import invalidate_tables  (через --py-files)
+
+import pyarrow as pa
+import threading
+import hashlib
+import json
+import re
+
+import redis
+
+# ------------------------------------------------------------------------------
+
+# Конфигурация Redis
+REDIS_HOST = 'redis'
+REDIS_PORT = 6379
+REDIS_PASSWORD = 'redispass'
+
+# TTL записи по умолчанию и максимальный размер одного результата
+CACHE_TTL = 300
+CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+KEY_PREFIX = 'qcache'
+
+_client = None
+_client_lock = threading.Lock()
+
+# ------------------------------------------------------------------------------
+
+# Возвращает общий на процесс клиент Redis (бинарный, без decode_responses)
+def get_redis_client():
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = redis.Redis(
+                    host=REDIS_HOST,
+                    port=REDIS_PORT,
+                    password=REDIS_PASSWORD,
+                    socket_timeout=5,
+                )
+    return _client
+
+# ------------------------------------------------------------------------------
+
+# Схлопывает пробелы и комментарии вне строковых литералов, убирает ; в конце
+# Одинаковые по смыслу запросы с разным форматированием получают один ключ
+def normalize_query(query):
+    parts = re.split(r"('(?:[^']|'')*')", query)
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2 == 1:
+            normalized.append(part)  # строковый литерал - без изменений
+        else:
+            part = re.sub(r"--[^\n]*", " ", part)
+            part = re.sub(r"/\*.*?\*/", " ", part, flags=re.S)
+            normalized.append(re.sub(r"\s+", " ", part))
+    return "".join(normalized).strip().rstrip(";").strip()
+
+
+# Таблицы, из которых читает запрос: все schema.table после FROM / JOIN
+def extract_tables(query):
+    names = re.findall(r'\b(?:from|join)\s+([A-Za-z_"][\w."]*)', query, flags=re.I)
+    return sorted({name.replace('"', '').lower() for name in names})
+
+
+def _table_version_key(table):
+    return f"{KEY_PREFIX}:table:{table.lower()}:version"
+
+
+# Ключ результата: запрос + параметры + база + текущие версии таблиц
+def make_cache_key(query, params=None, database="", tables=None):
+    normalized = normalize_query(query)
+    tables = sorted(t.lower() for t in tables) if tables is not None else extract_tables(normalized)
+
+    versions = get_redis_client().mget([_table_version_key(t) for t in tables]) if tables else []
+    payload = json.dumps({
+        'query': normalized,
+        'params': params or {},
+        'database': database,
+        'tables': dict(zip(tables, [v.decode() if v else '0' for v in versions])),
+    }, sort_keys=True, default=str)
+
+    return f"{KEY_PREFIX}:result:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+# ------------------------------------------------------------------------------
+
+# pandas DataFrame <-> Arrow IPC bytes
+def df_to_ipc(df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression='zstd')) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def ipc_to_df(payload):
+    return pa.ipc.open_stream(payload).read_all().to_pandas()
+
+# ------------------------------------------------------------------------------
+
+# Достает результат из кеша, None - промах или Redis недоступен
+def get_cached(key):
+    try:
+        payload = get_redis_client().get(key)
+    except redis.RedisError as e:
+        print(f"⚠️ Кеш запросов недоступен: {e}")
+        return None
+    return ipc_to_df(payload) if payload is not None else None
+
+
+# Кладет результат в кеш, если он не больше max_bytes
+# DataFrame, который Arrow не может сериализовать (object колонка со смешанными типами),
+# не кешируется - запрос уже выполнен, ошибка кеша не должна его ронять
+def set_cached(key, df, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+    try:
+        payload = df_to_ipc(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        print(f"⚠️ Результат не сериализуется в Arrow, не кешируем: {e}")
+        return False
+    if len(payload) > max_bytes:
+        print(f"⚠️ Результат {len(payload) / (1024 * 1024):.1f} MB больше лимита кеша, не кешируем")
+        return False
+    try:
+        get_redis_client().set(key, payload, ex=ttl)
+    except redis.RedisError as e:
+        print(f"⚠️ Кеш запросов недоступен: {e}")
+        return False
+    return True
+
+# ------------------------------------------------------------------------------
+
+# Инвалидирует все закешированные результаты, читающие из указанных таблиц
+# Вызывается джобами, которые перезаписывают таблицу
+def invalidate_tables(*tables):
+    client = get_redis_client()
+    with client.pipeline() as pipe:
+        for table in tables:
+            pipe.incr(_table_version_key(table))
+        pipe.execute()
+    print(f"Кеш запросов сброшен для таблиц: {', '.join(tables)}")
@@ -0,0 +1,153 @@
+# Метрики запросов коннекторов в statsd-exporter и журнал медленных запросов.
+#
+# На каждый вызов отправляется (UDP, без ожидания ответа):
+#   connectors.query.duration  - время, ms           (timer)
+#   connectors.query.calls     - число вызовов       (counter)
+#   connectors.query.errors    - число ошибок        (counter)
+#   connectors.query.rows      - строк передано      (counter)
+#   connectors.query.bytes     - байт передано       (counter)
+# с тегами operation (select / arrow / ddl / copy / upsert) и status.
+# В Prometheus они видны как connectors_query_duration{operation="select", ...}
+#
+# Вызовы дольше SLOW_QUERY_SECONDS пишутся в SLOW_QUERY_LOG (JSON Lines) вместе
+# с планом EXPLAIN, если коннектор смог его снять. План снимается в фоновом потоке
+# и без ANALYZE - вызывающий код не ждет, запрос повторно не выполняется.
+#
+# Настройка через переменные окружения:
+#   CONNECTORS_METRICS=0                 - отключить отправку метрик
+#   CONNECTORS_SLOW_QUERY_SECONDS=5      - порог медленного запроса, 0 - не собирать
+#   CONNECTORS_SLOW_QUERY_LOG=/path.jsonl
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import tempfile
+import threading
+import socket
+import json
+import time
+import os
+
+# ------------------------------------------------------------------------------
+
+# Тот же statsd-exporter, в который пишет метрики Airflow
+STATSD_HOST = os.environ.get("CONNECTORS_STATSD_HOST", "statsd-exporter")
+STATSD_PORT = int(os.environ.get("CONNECTORS_STATSD_PORT", 9125))
+STATSD_PREFIX = "connectors"
+
+METRICS_ENABLED = os.environ.get("CONNECTORS_METRICS", "1") != "0"
+
+SLOW_QUERY_SECONDS = float(os.environ.get("CONNECTORS_SLOW_QUERY_SECONDS", 5))
+SLOW_QUERY_LOG = os.environ.get(
+    "CONNECTORS_SLOW_QUERY_LOG",
+    os.path.join(os.environ.get("AIRFLOW_HOME", tempfile.gettempdir()), "logs", "slow_queries.jsonl"),
+)
+
+_socket = None
+_socket_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+# Один фоновый поток на процесс: планы снимаются по очереди, не нагружая базу
+_explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+
+# ------------------------------------------------------------------------------
+
+# Отправляет одну метрику в формате statsd с тегами DogStatsD (их понимает statsd-exporter)
+# Ошибки сети не мешают запросу - метрика просто теряется
+def send_metric(name, value, metric_type="c", tags=None):
+    global _socket
+
+    if not METRICS_ENABLED:
+        return
+
+    line = f"{STATSD_PREFIX}.{name}:{value}|{metric_type}"
+    if tags:
+        line += "|#" + ",".join(f"{key}:{tag}" for key, tag in tags.items())
+
+    try:
+        if _socket is None:
+            with _socket_lock:
+                if _socket is None:
+                    _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        _socket.sendto(line.encode(), (STATSD_HOST, STATSD_PORT))
+    except OSError:
+        pass
+
+
+# Дописывает запись о медленном запросе в журнал
+def log_slow_query(record):
+    try:
+        os.makedirs(os.path.dirname(SLOW_QUERY_LOG), exist_ok=True)
+        with _log_lock, open(SLOW_QUERY_LOG, "a") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    except OSError as e:
+        print(f"⚠️ Не удалось записать журнал медленных запросов: {e}")
+
+# ------------------------------------------------------------------------------
+
+# Оборачивает вызов коннектора: замеряет время, отправляет метрики,
+# для медленных вызовов снимает план через explain() в фоне и пишет его в журнал
+#
+# with track_query("select", query, explain=lambda: ...) as stats:
+#     df = ...
+#     stats["rows"], stats["bytes"] = len(df), df.memory_usage(deep=True).sum()
+#
+# explain - функция без аргументов, возвращающая текст плана (или None)
+@contextmanager
+def track_query(operation, query, explain=None):
+    stats = {"rows": 0, "bytes": 0}
+    status = "ok"
+    start_time = time.perf_counter()
+
+    try:
+        yield stats
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - start_time
+        tags = {"operation": operation, "status": status}
+
+        send_metric("query.duration", round(seconds * 1000, 3), "ms", tags)
+        send_metric("query.calls", 1, "c", tags)
+        if status == "error":
+            send_metric("query.errors", 1, "c", tags)
+        if stats["rows"]:
+            send_metric("query.rows", int(stats["rows"]), "c", tags)
+        if stats["bytes"]:
+            send_metric("query.bytes", int(stats["bytes"]), "c", tags)
+
+        if SLOW_QUERY_SECONDS and seconds >= SLOW_QUERY_SECONDS:
+            _capture_slow_query(operation, query, seconds, stats, status, explain)
+
+
+def _capture_slow_query(operation, query, seconds, stats, status, explain):
+    print(f"🐢 Медленный запрос ({operation}): {seconds:.2f} с, {int(stats['rows'])} строк")
+    record = {
+        "captured_at": datetime.now(timezone.utc).isoformat(),
+        "operation": operation,
+        "seconds": round(seconds, 3),
+        "rows": int(stats["rows"]),
+        "bytes": int(stats["bytes"]),
+        "status": status,
+        "query": query,
+        "plan": None,
+    }
+
+    if explain is None or status != "ok":
+        log_slow_query(record)
+        return
+
+    try:
+        _explain_executor.submit(_explain_and_log, record, explain)
+    except RuntimeError:
+        # Интерпретатор завершается - пишем без плана
+        log_slow_query(record)
+
+
+def _explain_and_log(record, explain):
+    try:
+        record["plan"] = explain()
+    except Exception as e:
+        record["plan"] = f"EXPLAIN не выполнен: {e}"
+    log_slow_query(record)
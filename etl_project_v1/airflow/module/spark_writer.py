@@ -0,0 +1,127 @@
+# Запись Spark DataFrame в parquet файлами заданного размера.
+#
+# Spark:    from spark_writer import write_parquet_sized
+#           (файл передается в spark-submit через --py-files /opt/airflow/module/spark_writer.py)
+#
+# Вместо coalesce(1) (весь месяц пишет одна задача) число файлов считается
+# по оценке объема данных: ~128 MB на файл, файлы пишутся параллельно.
+# С sort_column данные режутся по диапазонам колонки и сортируются внутри файла,
+# поэтому min/max колонки в статистике parquet у каждого файла узкие и
+# фильтр по ней (WHERE tpep_pickup_datetime BETWEEN ...) пропускает лишние файлы.
+#
+# write_parquet_published - то же, но новой версией месяца: файлы пишутся в
+# year=/month=/run=<run_id>/, читатели переключаются на нее записью _SUCCESS месяца.
+
+import math
+
+# Общие функции работы с MinIO: airflow/module/storage.py, приходит через --py-files
+from storage import RUN_PARTITION, make_run_id, publish_month_runs
+
+# ------------------------------------------------------------------------------
+
+# Целевой размер одного выходного файла
+TARGET_FILE_BYTES = 128 * 1024 * 1024
+
+# Верхняя граница числа файлов на одну запись (защита от неверной оценки)
+MAX_FILES = 1000
+
+# ------------------------------------------------------------------------------
+
+def estimate_size_bytes(df):
+    """
+    Оценка объема DataFrame в байтах по статистике оптимизированного плана.
+
+    Не запускает джоб: для чтения parquet это размер файлов на диске,
+    пересчитанный на выбранные колонки. Возвращает None, если оценки нет.
+    После join без CBO оценка - произведение размеров сторон, поэтому
+    для таких планов размер лучше оценивать до join и передавать явно.
+    """
+    try:
+        size = df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes()
+        return int(str(size))
+    except Exception as e:
+        print(f"⚠️ Не удалось оценить размер DataFrame: {e}")
+        return None
+
+
+def get_num_files(df, target_file_bytes=TARGET_FILE_BYTES, size_bytes=None):
+    """Число выходных файлов, чтобы каждый был около target_file_bytes"""
+    size = size_bytes if size_bytes is not None else estimate_size_bytes(df)
+    if size is None:
+        return df.rdd.getNumPartitions()
+    return max(1, min(MAX_FILES, math.ceil(size / target_file_bytes)))
+
+
+def write_parquet_sized(df, output_path, target_file_bytes=TARGET_FILE_BYTES, sort_column=None,
+                        partition_by=None, mode="overwrite", compression="snappy", size_bytes=None,
+                        dynamic_overwrite=True):
+    """
+    Пишет DataFrame в parquet файлами около target_file_bytes.
+
+    sort_column=None - данные равномерно перемешиваются по файлам (repartition).
+    sort_column="tpep_pickup_datetime" - файлы нарезаются по диапазонам колонки
+    (repartitionByRange) и сортируются внутри, у каждого файла свой узкий
+    интервал времени. Оценка границ диапазонов - отдельный быстрый проход по выборке.
+    partition_by - колонки для partitionBy; диапазоны строятся с учетом них,
+    чтобы файл по возможности не пересекал границу партиции. Перезапись в этом
+    случае динамическая: заменяются только партиции, которые есть в df
+    (dynamic_overwrite=False - для S3A коммиттеров, они ее не поддерживают).
+    size_bytes - готовая оценка объема вместо оценки по плану df.
+
+    Возвращает число задач записи.
+    """
+    partition_columns = [partition_by] if isinstance(partition_by, str) else list(partition_by or [])
+    num_files = get_num_files(df, target_file_bytes, size_bytes)
+
+    if sort_column:
+        df_out = (df
+                  .repartitionByRange(num_files, *partition_columns, sort_column)
+                  .sortWithinPartitions(*partition_columns, sort_column))
+    elif partition_columns:
+        # Хеш строки вместо колонки сортировки: файлы внутри партиции одного размера
+        from pyspark.sql import functions as F
+        df_out = df.repartitionByRange(num_files, *partition_columns, F.xxhash64(*df.columns))
+    else:
+        df_out = df.repartition(num_files)
+
+    writer = df_out.write.mode(mode).option("compression", compression)
+    if partition_columns:
+        writer = writer.partitionBy(*partition_columns)
+        if dynamic_overwrite:
+            writer = writer.option("partitionOverwriteMode", "dynamic")
+    writer.parquet(output_path)
+
+    print(f"   Записано задачами: {num_files} (~{target_file_bytes // (1024 * 1024)} MB на файл) -> {output_path}")
+    return num_files
+
+
+def write_parquet_published(df, bucket_name, prefix, months, partition_by=("year", "month"),
+                            sort_column=None, target_file_bytes=TARGET_FILE_BYTES, size_bytes=None):
+    """
+    Пишет месяцы DataFrame в раскладку year=/month= под prefix с атомарной публикацией.
+
+    1. Spark дописывает df новой версией run=<run_id> внутри папок месяцев
+       (append, прежние версии не трогаются; S3A коммиттер из конфигурации джоба)
+    2. _SUCCESS каждого месяца переписывается указателем на run_id - читатели
+       переключаются на новую версию одной записью, старые версии удаляются
+       после этого (storage.publish_month_runs)
+
+    До шага 2 читатели видят прежнюю версию месяца целиком. Упавший джоб
+    оставляет только неопубликованную папку run=, ее никто не читает, а удалит
+    следующая публикация месяца. Поэтому инкрементальная логика
+    (get_processed_slices(require_success=True)) не пропустит недописанный месяц.
+    months - месяцы 'YYYY-MM' этого запуска. Возвращает опубликованные месяцы.
+    """
+    from pyspark.sql import functions as F
+
+    run_id = make_run_id()
+    partition_columns = [partition_by] if isinstance(partition_by, str) else list(partition_by)
+    # run сразу после month: версия - папка месяца целиком, вместе с day= внутри
+    extra_columns = [column for column in partition_columns if column not in ("year", "month")]
+
+    write_parquet_sized(df.withColumn(RUN_PARTITION, F.lit(run_id)), f"s3a://{bucket_name}/{prefix}",
+                        target_file_bytes=target_file_bytes, sort_column=sort_column,
+                        partition_by=["year", "month", RUN_PARTITION, *extra_columns],
+                        mode="append", size_bytes=size_bytes, dynamic_overwrite=False)
+
+    return publish_month_runs(bucket_name, prefix, months, run_id)
@@ -0,0 +1,437 @@
+# Общий слой работы с MinIO для тасок Airflow, Spark джобов и ноутбуков.
+#
+# Airflow:  from module.storage import get_minio_client
+# Jupyter:  from module.storage import get_minio_client
+# Spark:    from storage import get_minio_client
+#           (файл передается в spark-submit через --py-files /opt/airflow/module/storage.py)
+
+from minio import Minio
+from minio.commonconfig import CopySource
+from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import threading
+import urllib3
+import uuid
+import json
+import time
+import io
+import re
+
+# ------------------------------------------------------------------------------
+
+# Конфигурация MinIO
+MINIO_ENDPOINT = 'minio:9000'
+MINIO_ACCESS_KEY = 'minioadmin'
+MINIO_SECRET_KEY = 'minioadmin'
+
+# Размер пула соединений общего клиента (параллельные загрузки по частям)
+MINIO_POOL_SIZE = 64
+
+# Сколько секунд живет закешированный листинг префикса
+LISTING_CACHE_TTL = 30
+
+# Партиционированная раскладка silver: <prefix>year=2025/month=1/[day=15/]
+# (имена и значения - как их пишет Spark partitionBy("year", "month"))
+PARTITION_PATTERN = re.compile(r'year=(\d{4})/month=(\d{1,2})/')
+
+# Маркер готовности папки среза: пишется последним, без него срез считается недописанным
+SUCCESS_MARKER = '_SUCCESS'
+
+# Версии месяца в silver: <prefix>year=2025/month=1/run=<run_id>/part-*.parquet.
+# _SUCCESS месяца - указатель {"run_id": ...} на опубликованную версию, читатели
+# читают только ее. Новая версия пишется рядом и публикуется одной записью _SUCCESS
+RUN_PARTITION = 'run'
+RUN_PATTERN = re.compile(r'^run=([^/]+)/')
+
+_client = None
+_client_lock = threading.Lock()
+
+_listing_cache = {}
+_listing_cache_lock = threading.Lock()
+
+# ------------------------------------------------------------------------------
+
+def get_minio_client():
+    """
+    Возвращает общий на процесс клиент MinIO.
+
+    Клиент создается один раз, все вызовы делят один пул keep-alive соединений.
+    Клиент потокобезопасен.
+    """
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                http_client = urllib3.PoolManager(
+                    timeout=urllib3.Timeout(connect=10, read=300),
+                    maxsize=MINIO_POOL_SIZE,
+                    retries=urllib3.Retry(total=5, backoff_factor=0.2,
+                                          status_forcelist=[500, 502, 503, 504]),
+                )
+                _client = Minio(
+                    MINIO_ENDPOINT,
+                    access_key=MINIO_ACCESS_KEY,
+                    secret_key=MINIO_SECRET_KEY,
+                    secure=False,
+                    http_client=http_client,
+                )
+    return _client
+
+# ------------------------------------------------------------------------------
+
+def extract_month_from_filename(file_path):
+    """Извлекает месяц из имени файла в формате YYYY-MM (или из пути year=YYYY/month=M/)"""
+    match = PARTITION_PATTERN.search(file_path)
+    if match:
+        return f"{match.group(1)}-{int(match.group(2)):02d}"
+    match = re.search(r'(\d{4}-\d{2})', file_path)
+    return match.group(1) if match else None
+
+
+def month_partition_prefix(prefix, month):
+    """Папка месяца в партиционированной раскладке: ('nyc-taxi-data-eda/', '2025-01') -> 'nyc-taxi-data-eda/year=2025/month=1/'"""
+    year, month_number = month.split('-')
+    return f"{prefix}year={int(year)}/month={int(month_number)}/"
+
+# ------------------------------------------------------------------------------
+
+def list_prefix(bucket_name, prefix, recursive=False, use_cache=True):
+    """
+    Листинг префикса в MinIO с коротким кешем.
+
+    recursive=False - листинг с разделителем '/': только объекты и "папки"
+    первого уровня, без обхода всего содержимого.
+    Возвращает список (object_name, is_dir).
+    """
+    key = (bucket_name, prefix, recursive)
+    now = time.monotonic()
+
+    if use_cache:
+        with _listing_cache_lock:
+            cached = _listing_cache.get(key)
+        if cached and now - cached[0] < LISTING_CACHE_TTL:
+            return cached[1]
+
+    client = get_minio_client()
+    objects = [
+        (obj.object_name, obj.is_dir)
+        for obj in client.list_objects(bucket_name, prefix=prefix, recursive=recursive)
+    ]
+
+    with _listing_cache_lock:
+        _listing_cache[key] = (now, objects)
+    return objects
+
+
+def invalidate_listing_cache(bucket_name=None, prefix=None):
+    """Сбрасывает кеш листингов бакета / префикса (после записи в него)"""
+    with _listing_cache_lock:
+        for key in list(_listing_cache):
+            cached_bucket, cached_prefix, _ = key
+            if bucket_name is not None and cached_bucket != bucket_name:
+                continue
+            if prefix is not None and not cached_prefix.startswith(prefix):
+                continue
+            del _listing_cache[key]
+
+# ------------------------------------------------------------------------------
+
+def list_month_partitions(bucket_name, prefix):
+    """
+    Папки месяцев партиционированной раскладки под префиксом.
+
+    Два листинга с разделителем: годы (year=YYYY/) и месяцы внутри каждого года,
+    содержимое месяцев (day=, part файлы) не читается.
+    Возвращает список (папка месяца, 'YYYY-MM'), старые папки вида
+    yellow_tripdata_YYYY-MM/ пропускаются.
+    """
+    partitions = []
+    for year_prefix, is_dir in list_prefix(bucket_name, prefix, recursive=False):
+        if not (is_dir and year_prefix[len(prefix):].startswith('year=')):
+            continue
+        for month_prefix, is_month_dir in list_prefix(bucket_name, year_prefix, recursive=False):
+            month = extract_month_from_filename(month_prefix)
+            if is_month_dir and month:
+                partitions.append((month_prefix, month))
+    return partitions
+
+# ------------------------------------------------------------------------------
+
+def list_objects(bucket_name, prefix):
+    """Все объекты под префиксом (рекурсивно, без кеша)"""
+    return [name for name, is_dir in list_prefix(bucket_name, prefix, recursive=True, use_cache=False) if not is_dir]
+
+
+def copy_prefix(bucket_name, source_prefix, target_prefix, max_workers=16):
+    """Копирует все объекты папки в другую папку на стороне MinIO (без скачивания)"""
+    client = get_minio_client()
+    objects = list_objects(bucket_name, source_prefix)
+
+    def copy(object_name):
+        target = target_prefix + object_name[len(source_prefix):]
+        client.copy_object(bucket_name, target, CopySource(bucket_name, object_name))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(copy, objects))
+    return len(objects)
+
+
+def remove_prefix(bucket_name, prefix):
+    """Удаляет все объекты под префиксом пакетными запросами"""
+    client = get_minio_client()
+    objects = list_objects(bucket_name, prefix)
+    errors = list(client.remove_objects(bucket_name, [DeleteObject(name) for name in objects]))
+    if errors:
+        raise RuntimeError(f"Не удалось удалить {len(errors)} объектов из {prefix}: {errors[0]}")
+    return len(objects)
+
+# ------------------------------------------------------------------------------
+
+def make_run_id():
+    """Id версии месяца: время UTC + случайный суффикс, сортируется по времени записи"""
+    return f"{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def month_run_prefix(month_prefix, run_id):
+    """Папка версии месяца: 'nyc-taxi-data-eda/year=2025/month=1/' -> '.../month=1/run=<run_id>/'"""
+    return f"{month_prefix}{RUN_PARTITION}={run_id}/"
+
+
+def has_success_marker(bucket_name, slice_prefix):
+    """Проверяет, что в папке среза есть маркер _SUCCESS (записан коммиттером Spark)"""
+    try:
+        get_minio_client().stat_object(bucket_name, f"{slice_prefix}{SUCCESS_MARKER}")
+        return True
+    except S3Error as e:
+        if e.code in ('NoSuchKey', 'NoSuchObject', 'NotFound'):
+            return False
+        raise
+
+
+def read_success_marker(bucket_name, slice_prefix):
+    """
+    Содержимое маркера _SUCCESS папки среза.
+
+    None - маркера нет; {} - маркер не JSON (пустой _SUCCESS коммиттера Spark).
+    """
+    try:
+        response = get_minio_client().get_object(bucket_name, f"{slice_prefix}{SUCCESS_MARKER}")
+        try:
+            payload = response.read()
+        finally:
+            response.close()
+            response.release_conn()
+    except S3Error as e:
+        if e.code in ('NoSuchKey', 'NoSuchObject', 'NotFound'):
+            return None
+        raise
+
+    try:
+        marker = json.loads(payload)
+    except ValueError:
+        return {}
+    return marker if isinstance(marker, dict) else {}
+
+
+def write_success_marker(bucket_name, slice_prefix, info=None):
+    """Пишет маркер готовности в папку среза (JSON с деталями публикации) - одна атомарная запись"""
+    payload = json.dumps({
+        'published_at': datetime.now(timezone.utc).isoformat(),
+        **(info or {}),
+    }).encode()
+    get_minio_client().put_object(
+        bucket_name, f"{slice_prefix}{SUCCESS_MARKER}", io.BytesIO(payload), len(payload),
+        content_type='application/json',
+    )
+
+
+def get_published_run(bucket_name, month_prefix):
+    """Маркер опубликованной версии месяца ({'run_id', 'files', ...}) или None, если месяц не опубликован"""
+    marker = read_success_marker(bucket_name, month_prefix)
+    if not marker or not marker.get('run_id'):
+        return None
+    return marker
+
+
+def list_published_months(bucket_name, prefix, from_month=None, to_month=None, max_workers=16):
+    """
+    Опубликованные месяцы под префиксом за период ('YYYY-MM', границы включены).
+
+    Возвращает список (месяц, папка опубликованной версии run=<run_id>/) по
+    возрастанию месяца. Месяцы без строк (files=0) и без маркера-указателя пропускаются.
+    Маркеры читаются параллельно, по одному GET на месяц.
+    """
+    partitions = [
+        (month_prefix, month)
+        for month_prefix, month in list_month_partitions(bucket_name, prefix)
+        if (not from_month or month >= from_month) and (not to_month or month <= to_month)
+    ]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        markers = list(executor.map(lambda partition: get_published_run(bucket_name, partition[0]), partitions))
+
+    published = [
+        (month, month_run_prefix(month_prefix, marker['run_id']))
+        for (month_prefix, month), marker in zip(partitions, markers)
+        if marker and marker.get('files', 1)
+    ]
+    return sorted(published)
+
+
+def remove_superseded_runs(bucket_name, month_prefix, run_id):
+    """
+    Удаляет из папки месяца версии старше run_id и файлы старой раскладки без run=.
+
+    _SUCCESS, версия run_id и более новые (их может писать другой запуск) не трогаются.
+    """
+    stale = []
+    for object_name in list_objects(bucket_name, month_prefix):
+        relative = object_name[len(month_prefix):]
+        if relative == SUCCESS_MARKER:
+            continue
+        match = RUN_PATTERN.match(relative)
+        if match and match.group(1) >= run_id:
+            continue
+        stale.append(object_name)
+
+    if stale:
+        errors = list(get_minio_client().remove_objects(bucket_name, [DeleteObject(name) for name in stale]))
+        if errors:
+            raise RuntimeError(f"Не удалось удалить {len(errors)} объектов из {month_prefix}: {errors[0]}")
+    return len(stale)
+
+
+def publish_month_runs(bucket_name, prefix, months, run_id):
+    """
+    Публикует версию run_id месяцев, уже записанную Spark в year=/month=/run=<run_id>/.
+
+    Для каждого месяца:
+        1. _SUCCESS месяца перезаписывается указателем на run_id - одна запись
+           объекта, читатели переключаются на новую версию атомарно
+        2. удаляются старые версии месяца - уже после переключения
+    До шага 1 читатели видят прежнюю версию целиком; падение между шагами
+    оставляет лишние старые версии, их удалит следующая публикация.
+    months - ожидаемые месяцы 'YYYY-MM': месяц без строк публикуется с files=0,
+    иначе его бы пересчитывали каждый запуск.
+    """
+    published = []
+    for month in sorted(set(months)):
+        month_prefix = month_partition_prefix(prefix, month)
+        run_prefix = month_run_prefix(month_prefix, run_id)
+        files = [name for name in list_objects(bucket_name, run_prefix) if name.endswith('.parquet')]
+
+        write_success_marker(bucket_name, month_prefix, {'run_id': run_id, 'files': len(files)})
+        removed = remove_superseded_runs(bucket_name, month_prefix, run_id)
+
+        print(f"   📦 Опубликован {month}: {len(files)} файлов (удалено старых объектов: {removed}) "
+              f"-> {bucket_name}/{run_prefix}")
+        published.append(month)
+
+    invalidate_listing_cache(bucket_name)
+    return published
+
+
+def get_processed_slices(output_bucket, output_prefix, require_success=False, count_legacy=True):
+    """
+    Возвращает список уже обработанных срезов из выходного бакета используя MinIO.
+
+    Листинг идет с разделителем: читаются только папки срезов
+    (yellow_tripdata_2025-01/ или year=2025/month=1/), а не все part файлы
+    внутри них, поэтому стоимость растет с числом месяцев, а не с числом файлов.
+    Обе раскладки могут лежать под префиксом одновременно (до миграции).
+    require_success=True - срез считается готовым только при наличии _SUCCESS,
+    для папки year=/month= - маркера-указателя на опубликованную версию run=
+    (один запрос на месяц).
+    count_legacy=False - срезы старой раскладки не считаются обработанными:
+    для слоев, читатели которых видят только year=/month= (EDA), такие месяцы
+    должны пересчитаться в новую раскладку.
+    """
+    try:
+        processed_slices = set()
+
+        slices = [
+            (object_name, is_dir)
+            for object_name, is_dir in list_prefix(output_bucket, output_prefix, recursive=False)
+            if count_legacy and not object_name[len(output_prefix):].startswith('year=')
+        ]
+        partitions = [month_prefix for month_prefix, _ in list_month_partitions(output_bucket, output_prefix)]
+
+        for object_name, is_dir in slices:
+            month = extract_month_from_filename(object_name)
+            if not month:
+                continue
+            if require_success and is_dir and not has_success_marker(output_bucket, object_name):
+                print(f"⚠️ Срез {object_name} без _SUCCESS - считаем необработанным")
+                continue
+            processed_slices.add(month)
+
+        for month_prefix in partitions:
+            if require_success and get_published_run(output_bucket, month_prefix) is None:
+                print(f"⚠️ Месяц {month_prefix} без опубликованной версии - считаем необработанным")
+                continue
+            processed_slices.add(extract_month_from_filename(month_prefix))
+
+        print(f"📁 Найдено обработанных срезов в {output_bucket}/{output_prefix}: {len(processed_slices)}")
+        return processed_slices
+
+    except S3Error as e:
+        if e.code == 'NoSuchBucket':
+            print(f"⚠️ Бакет {output_bucket} не существует или пустой")
+        else:
+            print(f"⚠️ Ошибка при чтении {output_bucket} бакета: {e}")
+        return set()
+    except Exception as e:
+        print(f"⚠️ Не удалось прочитать {output_bucket} бакет: {e}")
+        return set()
+
+# ------------------------------------------------------------------------------
+
+def get_input_files_with_months(input_bucket, input_prefix):
+    """
+    Возвращает список файлов/папок из входного бакета с извлеченными месяцами используя MinIO.
+
+    Для партиционированной раскладки каждый опубликованный месяц - отдельный
+    элемент с путем к его версии (year=2025/month=1/run=<run_id>/) и file_name
+    'year=2025/month=1/'; месяцы без маркера-указателя пропускаются. Если месяц
+    есть и в папке year=/month=, и в старой раскладке (миграция еще не
+    выполнена), берется только партиция - иначе месяц обработался бы дважды.
+    """
+    try:
+        input_files = []
+        partition_months = set()
+
+        for month, run_prefix in list_published_months(input_bucket, input_prefix):
+            partition_months.add(month)
+            input_files.append({
+                'path': f"s3a://{input_bucket}/{run_prefix}",
+                'month': month,
+                'file_name': month_partition_prefix(input_prefix, month)[len(input_prefix):],
+            })
+
+        for object_name, _ in list_prefix(input_bucket, input_prefix, recursive=False):
+            if object_name[len(input_prefix):].startswith('year='):
+                continue
+            is_parquet_file = object_name.endswith('.parquet')
+            is_folder = not is_parquet_file and object_name.endswith('/')
+
+            if is_parquet_file or is_folder:
+                month = extract_month_from_filename(object_name)
+                if month in partition_months:
+                    print(f"⚠️ {object_name} пропущен: месяц {month} уже в раскладке year=/month=")
+                elif month:
+                    s3_path = f"s3a://{input_bucket}/{object_name}"
+                    input_files.append({
+                        'path': s3_path,
+                        'month': month,
+                        'file_name': object_name.split('/')[-1] if is_parquet_file else object_name.split('/')[-2] + '/'
+                    })
+
+        print(f"📁 Найдено объектов в {input_bucket}/{input_prefix}: {len(input_files)}")
+        return input_files
+
+    except Exception as e:
+        print(f"❌ Ошибка при чтении {input_bucket} бакета: {e}")
+        return []
@@ -1,97 +1,587 @@
-from minio import Minio
 from minio.error import S3Error
+from module.storage import get_minio_client
+from tasks.nyc_taxi.nyc_throttle import (
+    ThrottledSession,
+    PROBE_THROTTLE_STATUSES,
+    get_backoff,
+    get_host_limiter,
+)
+from tasks.nyc_taxi.nyc_parquet import inspect_parquet_footer, rechunk_parquet_file
+from tasks.nyc_taxi.nyc_manifest import (
+    MANIFEST_NAME,
+    load_manifest,
+    save_manifest,
+    bootstrap_manifest,
+    adopt_remote_meta,
+    get_changed_files,
+    make_manifest_entry,
+)
 import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from collections import deque
+from functools import partial
+import http.client
+import hashlib
+import json
+import time
 import os
 import tempfile
 
 
 
-def get_available_remote_files(base_url, filename_template, year):
-    """Проверить какие файлы фактически существуют на сайте"""
-    available_files = []
-
-    print("🔍 Проверка доступных файлов на сайте...")
-
-
-    # СТАРАЯ ВЕРСИЯ
-    # for month in tqdm(range(1, 13), desc="Проверка месяца"):
-    #     filename = filename_template.format(year=year, month=month)
-    #     url = f"{base_url}/{filename}"
-    #
-    #     try:
-    #         response = requests.head(url, timeout=10)
-    #         if response.status_code == 200:
-    #             available_files.append(filename)
-    #             print(f"  ✓ {filename} - доступен")
-    #         else:
-    #             print(f"  ✗ {filename} - недоступен (код: {response.status_code})")
-    #
-    #     except requests.exceptions.RequestException as e:
-    #         print(f"  ✗ {filename} - ошибка: {e}")
-
-    # Имитируем браузер
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1',
+# Имитируем браузер
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+# Файлы меньше этого размера считаем заглушками
+MIN_REMOTE_FILE_SIZE = 1000
+
+# Размер part в multipart загрузке MinIO (минимум 5 MB)
+MINIO_PART_SIZE = 16 * 1024 * 1024
+
+# Сегментная загрузка по умолчанию: размер сегмента и число параллельных соединений
+SEGMENTED_PART_SIZE = 32 * 1024 * 1024
+SEGMENTED_CONNECTIONS = 4
+
+# Сколько раз повторяется один сегмент, прежде чем загрузка файла прерывается
+SEGMENT_RETRIES = 5
+
+# Недокачанные файлы и их чекпоинты переживают падение таски
+PARTIAL_DIR = os.path.join(tempfile.gettempdir(), 'nyc_taxi_partial')
+
+
+def get_http_session(pool_size=16):
+    """
+    Создает HTTP сессию с keep-alive пулом соединений на pool_size коннектов.
+
+    Сессия троттлится: общий на процесс темп и AIMD лимит по хосту,
+    повторы с экспоненциальной задержкой на 403/429/5xx (см. nyc_throttle).
+    """
+    session = ThrottledSession()
+    session.headers.update(HEADERS)
+
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def probe_remote_file(session, url, timeout=10):
+    """
+    Дешевая проверка файла на сайте без скачивания тела.
+
+    Сначала HEAD, если сервер его не принял - GET с Range: bytes=0-0.
+    Возвращает dict со status_code, content_length, etag и last_modified.
+    """
+    response = session.head(url, timeout=timeout, allow_redirects=True,
+                            throttle_statuses=PROBE_THROTTLE_STATUSES)
+    response.close()
+
+    if response.status_code not in (200, 404):
+        response = session.get(url, headers={'Range': 'bytes=0-0'},
+                               timeout=timeout, stream=True,
+                               throttle_statuses=PROBE_THROTTLE_STATUSES)
+        response.close()
+
+    content_length = int(response.headers.get('Content-Length', 0))
+
+    # На Range запрос Content-Length = 1, полный размер лежит в Content-Range: bytes 0-0/12345
+    if response.status_code == 206:
+        content_range = response.headers.get('Content-Range', '')
+        total = content_range.rsplit('/', 1)[-1]
+        content_length = int(total) if total.isdigit() else 0
+
+    return {
+        'status_code': 200 if response.status_code == 206 else response.status_code,
+        'content_length': content_length,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
     }
 
-    for month in tqdm(range(1, 13), desc="Проверка месяца"):
-        filename = filename_template.format(year=year, month=month)
-        url = f"{base_url}/{filename}"
 
+def normalize_years(years):
+    """2025 / '2025' / range(2015, 2026) / ['2024', 2025] -> [2024, 2025]"""
+    if years is None:
+        raise ValueError("Не задан год: передайте year или years")
+    if isinstance(years, (int, str)):
+        years = [years]
+    try:
+        return [int(y) for y in years]
+    except (TypeError, ValueError):
+        raise ValueError(f"Некорректный год: {years!r}")
+
+
+def get_available_remote_files(base_url, filename_template, year=None, years=None, max_workers=16,
+                               with_meta=False):
+    """
+    Проверить какие файлы фактически существуют на сайте.
+
+    year - один год или диапазон лет (range(2015, 2026)), years - синоним для диапазона.
+    filename_template - шаблон или список шаблонов (yellow/green/fhv).
+    Все месяцы проверяются параллельно через одну keep-alive сессию.
+
+    with_meta=True - вместо списка имен вернуть {filename: {etag, content_length, last_modified}}
+    для сравнения с манифестом в download_missing_files.
+    """
+    years = normalize_years(year if years is None else years)
+    templates = [filename_template] if isinstance(filename_template, str) else list(filename_template)
+
+    filenames = [
+        template.format(year=y, month=month)
+        for template in templates
+        for y in years
+        for month in range(1, 13)
+    ]
+
+    print(f"🔍 Проверка доступных файлов на сайте: {len(filenames)} шт., потоков: {max_workers}")
+
+    session = get_http_session(pool_size=max_workers)
+    limiter = get_host_limiter(base_url, max_limit=max_workers, purpose='probe')
+    probes = {}
+
+    def probe(filename):
+        with limiter.slot():
+            return probe_remote_file(session, f"{base_url}/{filename}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(probe, filename): filename for filename in filenames}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Проверка месяца"):
+            filename = futures[future]
+            try:
+                probes[filename] = future.result()
+            except requests.exceptions.RequestException as e:
+                probes[filename] = {'error': e}
+
+    session.close()
+
+    available_files = {}
+
+    # Выводим в исходном порядке (шаблон, год, месяц), а не в порядке завершения
+    for filename in filenames:
+        probe = probes[filename]
+
+        if 'error' in probe:
+            print(f"  ✗ {filename} - ошибка: {probe['error']}")
+        elif probe['status_code'] != 200:
+            print(f"  ✗ {filename} - код: {probe['status_code']}")
+        elif probe['content_length'] > MIN_REMOTE_FILE_SIZE:  # Проверяем что файл не пустой
+            available_files[filename] = {
+                'etag': probe['etag'],
+                'content_length': probe['content_length'],
+                'last_modified': probe['last_modified'],
+            }
+            print(f"  ✓ {filename} - доступен ({probe['content_length']} bytes)")
+        else:
+            print(f"  ⚠ {filename} - маленький размер ({probe['content_length']} bytes)")
+
+    return available_files if with_meta else list(available_files)
+
+
+
+
+def add_progress_total(progress, size):
+    """Увеличивает ожидаемый объем общего tqdm счетчика из любого потока"""
+    if progress is not None and size:
+        with progress.get_lock():
+            progress.total += size
+            progress.refresh()
+
+
+def load_partial_state(part_path):
+    """Читает чекпоинт недокачанного файла: validator и полный размер"""
+    state_path = f"{part_path}.json"
+    if not (os.path.exists(part_path) and os.path.exists(state_path)):
+        return None
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_partial_state(part_path, url, response):
+    """Сохраняет validator (ETag / Last-Modified) рядом с недокачанным файлом"""
+    content_range = response.headers.get('Content-Range', '')
+    total = content_range.rsplit('/', 1)[-1]
+    total_size = int(total) if total.isdigit() else int(response.headers.get('Content-Length', 0))
+
+    state = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'total_size': total_size,
+    }
+    with open(f"{part_path}.json", 'w') as f:
+        json.dump(state, f)
+    return state
+
+
+def remove_partial(part_path):
+    """Удаляет недокачанный файл и его чекпоинт"""
+    for path in (part_path, f"{part_path}.json"):
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def fetch_to_partial(session, url, part_path, progress=None):
+    """
+    Докачивает файл в part_path, продолжая с уже скачанного смещения.
+
+    Смещение - фактический размер part файла, validator лежит в part_path.json.
+    Запрос идет с Range + If-Range: если объект на сайте изменился,
+    сервер вернет 200 вместо 206 и файл начнется с нуля.
+    Возвращает итоговый размер файла.
+    """
+    state = load_partial_state(part_path)
+    offset = os.path.getsize(part_path) if state else 0
+
+    # Без сжатия: смещения в Range считаются по байтам тела
+    headers = {'Accept-Encoding': 'identity'}
+    validator = state and (state.get('etag') or state.get('last_modified'))
+    if offset and validator:
+        headers['Range'] = f"bytes={offset}-"
+        headers['If-Range'] = validator
+    else:
+        offset = 0
+
+    # Повторы с докачкой делает download_file_to_minio, сессия не повторяет
+    response = session.get(url, stream=True, timeout=60, headers=headers, retries=0)
+    try:
+        # Смещение уже за концом объекта - файл либо докачан, либо объект стал меньше
+        if response.status_code == 416:
+            if offset == state.get('total_size'):
+                return offset
+            remove_partial(part_path)
+            raise IOError(f"Недокачанный файл не совпадает с объектом на сайте, начнем заново: {url}")
+
+        response.raise_for_status()
+
+        if response.status_code == 206:
+            print(f"  ↻ Докачка {os.path.basename(part_path)} с {offset / (1024 * 1024):.1f} MB")
+            file_mode = 'ab'
+        else:
+            if offset:
+                print(f"  ⚠ Объект изменился на сайте, качаем заново: {os.path.basename(part_path)}")
+            offset = 0
+            file_mode = 'wb'
+            state = save_partial_state(part_path, url, response)
+
+        add_progress_total(progress, state['total_size'] - offset)
+
+        with open(part_path, file_mode) as part_file:
+            for chunk in response.iter_content(chunk_size=8192 * 8):
+                if chunk:
+                    part_file.write(chunk)
+                    if progress is not None:
+                        progress.update(len(chunk))
+
+    finally:
+        response.close()
+
+    file_size = os.path.getsize(part_path)
+    if state['total_size'] and file_size != state['total_size']:
+        raise IOError(f"Скачано {file_size} из {state['total_size']} байт: {url}")
+    return file_size
+
+
+def file_sha256(path, chunk_size=8 * 1024 * 1024):
+    """Считает sha256 файла на диске"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download_file_to_minio(session, minio_client, url, bucket_name, object_name,
+                           progress=None, retries=3, partial_dir=PARTIAL_DIR, transform=None):
+    """
+    Скачивает файл на диск с докачкой и загружает его в MinIO.
+
+    Недокачанный файл и его чекпоинт хранятся в partial_dir между попытками
+    и между запусками DAG. Удаляются только после успешной загрузки в MinIO.
+    progress - общий tqdm счетчик байт, в который отчитываются все потоки.
+    transform - функция path -> новый path, применяется к скачанному файлу перед загрузкой.
+    Возвращает (размер скачанного файла в байтах, контрольная сумма скачанного файла).
+    """
+    os.makedirs(partial_dir, exist_ok=True)
+    part_path = os.path.join(partial_dir, object_name.replace('/', '__') + '.part')
+
+    for attempt in range(1, retries + 1):
         try:
-            # Пробуем с разными заголовками
-            response = requests.get(url, headers=headers, timeout=10, stream=True)
+            file_size = fetch_to_partial(session, url, part_path, progress=progress)
+            break
+        except (requests.exceptions.RequestException, IOError) as e:
+            if attempt == retries:
+                raise
+            print(f"  ⚠ {os.path.basename(url)}: попытка {attempt}/{retries} не удалась ({e}), повтор")
+            time.sleep(get_backoff(attempt, getattr(e, 'response', None)))
 
-            # Проверяем статус код
-            if response.status_code == 200:
-                # Также проверяем содержание ответа - если файл существует,
-                # должны получить нормальные заголовки для файла
-                content_type = response.headers.get('Content-Type', '')
-                content_length = response.headers.get('Content-Length', '0')
+    checksum = f"sha256:{file_sha256(part_path)}"
+    upload_path = transform(part_path) if transform else part_path
 
-                # Парагветные файлы обычно имеют content-type 'application/octet-stream' или подобный
-                if int(content_length) > 1000:  # Проверяем что файл не пустой
-                    available_files.append(filename)
-                    print(f"  ✓ {filename} - доступен ({content_length} bytes)")
-                else:
-                    print(f"  ⚠ {filename} - маленький размер ({content_length} bytes)")
+    try:
+        # Загружаем в MinIO
+        minio_client.fput_object(
+            bucket_name=bucket_name,
+            object_name=object_name,
+            file_path=upload_path
+        )
+    finally:
+        if upload_path != part_path and os.path.exists(upload_path):
+            os.unlink(upload_path)
+
+    remove_partial(part_path)
+    return file_size, checksum
+
+
+class ChunkStream:
+    """
+    Файлоподобная обертка над итератором чанков bytes для minio.put_object.
+
+    Отдает ровно столько байт, сколько просят, держа в памяти не больше одного чанка.
+    """
+
+    def __init__(self, chunks, progress=None):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+        self._progress = progress
+        self._digest = hashlib.sha256()
+        self.bytes_read = 0
+
+    @property
+    def checksum(self):
+        return f"sha256:{self._digest.hexdigest()}"
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+
+        self.bytes_read += len(data)
+        self._digest.update(data)
+        if self._progress is not None:
+            self._progress.update(len(data))
+        return data
+
+
+class ResponseStream(ChunkStream):
+    """ChunkStream поверх тела HTTP ответа (response.iter_content)"""
+
+    def __init__(self, response, chunk_size=1024 * 1024, progress=None):
+        super().__init__(response.iter_content(chunk_size=chunk_size), progress=progress)
+
+
+def stream_file_to_minio(session, minio_client, url, bucket_name, object_name,
+                         progress=None, part_size=MINIO_PART_SIZE):
+    """
+    Потоково перекладывает файл из HTTP ответа в MinIO multipart upload.
+
+    Временный файл не создается: в памяти одновременно живет только текущий part.
+    Если сайт не отдал Content-Length, грузим с неизвестной длиной (length=-1).
+    Возвращает (размер файла в байтах, контрольная сумма).
+    """
+    # Просим отдать файл без сжатия, чтобы Content-Length совпадал с телом
+    response = session.get(url, stream=True, timeout=60, headers={'Accept-Encoding': 'identity'})
+    try:
+        response.raise_for_status()
+
+        total_size = int(response.headers.get('content-length', 0))
+        add_progress_total(progress, total_size)
+
+        stream = ResponseStream(response, progress=progress)
 
-                response.close()
-            else:
-                print(f"  ✗ {filename} - код: {response.status_code}")
+        minio_client.put_object(
+            bucket_name=bucket_name,
+            object_name=object_name,
+            data=stream,
+            length=total_size or -1,
+            part_size=part_size,
+            num_parallel_uploads=1,
+        )
+        return stream.bytes_read, stream.checksum
 
-        except requests.exceptions.RequestException as e:
-            print(f"  ✗ {filename} - ошибка: {e}")
+    finally:
+        response.close()
 
 
-    return available_files
+def fetch_range(session, url, start, end):
+    """Скачивает байты [start, end] одного сегмента файла (один запрос, без повторов)"""
+    headers = {'Range': f"bytes={start}-{end}", 'Accept-Encoding': 'identity'}
+    response = session.get(url, headers=headers, timeout=60, retries=0)
+    response.raise_for_status()
 
+    if response.status_code != 206 or len(response.content) != end - start + 1:
+        raise IOError(f"Сервер не отдал сегмент {start}-{end} (код: {response.status_code}): {url}")
+    return response.content
 
 
+def fetch_segment(session, url, start, end, limiter=None, retries=SEGMENT_RETRIES):
+    """
+    Скачивает сегмент с повторами: обрыв или неполное тело стоят один сегмент, а не файл.
+
+    Повторяются сетевые ошибки, оборванное тело (ChunkedEncodingError,
+    IncompleteRead) и ответ не той длины. Слот limiter занят только на время
+    запроса, пауза между попытками его не держит.
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            with limiter.slot() if limiter is not None else nullcontext():
+                return fetch_range(session, url, start, end)
+        except (requests.exceptions.RequestException, http.client.IncompleteRead, IOError) as e:
+            if attempt == retries:
+                raise
+            print(f"  ⚠ {os.path.basename(url)}: сегмент {start}-{end}, попытка {attempt}/{retries} "
+                  f"не удалась ({e}), повтор")
+            time.sleep(get_backoff(attempt, getattr(e, 'response', None)))
+
+
+def iter_segments(session, url, total_size, part_size, connections, limiter=None):
+    """
+    Отдает сегменты файла по порядку, заранее скачивая до connections сегментов параллельно.
+
+    Каждый Range запрос занимает свой слот limiter хоста, поэтому сегментная
+    загрузка не обходит общий лимит параллельности по хосту. Упавший сегмент
+    повторяется сам по себе (fetch_segment).
+    """
+    ranges = iter([
+        (start, min(start + part_size, total_size) - 1)
+        for start in range(0, total_size, part_size)
+    ])
+
+    fetch = partial(fetch_segment, session, url, limiter=limiter)
+
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        pending = deque(executor.submit(fetch, *segment) for _, segment in zip(range(connections), ranges))
+        while pending:
+            data = pending.popleft().result()
+            segment = next(ranges, None)
+            if segment is not None:
+                pending.append(executor.submit(fetch, *segment))
+            yield data
+
+
+def segmented_file_to_minio(session, minio_client, url, bucket_name, object_name, progress=None,
+                            part_size=SEGMENTED_PART_SIZE, connections=SEGMENTED_CONNECTIONS, limiter=None):
+    """
+    Качает один большой файл в connections параллельных Range запросов.
+
+    Сегменты размером part_size качаются наперед и по порядку уходят в
+    minio.put_object, каждый сегмент - один part multipart upload'а.
+    В памяти живет не больше connections + 1 сегментов. Маленькие файлы
+    уходят в потоковый режим.
+    limiter - AdaptiveLimiter хоста: слот занимает каждый запрос к сайту, а не файл целиком.
+    Возвращает (размер файла в байтах, контрольная сумма).
+    """
+    slot = limiter.slot if limiter is not None else nullcontext
+
+    with slot():
+        probe = probe_remote_file(session, url)
+    total_size = probe['content_length']
+
+    if probe['status_code'] != 200 or total_size <= part_size:
+        with slot():
+            return stream_file_to_minio(session, minio_client, url, bucket_name, object_name, progress=progress)
+
+    add_progress_total(progress, total_size)
+
+    segments = iter_segments(session, url, total_size, part_size, connections, limiter=limiter)
+    stream = ChunkStream(segments, progress=progress)
+    try:
+        minio_client.put_object(
+            bucket_name=bucket_name,
+            object_name=object_name,
+            data=stream,
+            length=total_size,
+            part_size=part_size,
+            num_parallel_uploads=1,
+        )
+    finally:
+        # Дожидаемся уже запущенных Range запросов, если загрузка оборвалась
+        segments.close()
+
+    if stream.bytes_read != total_size:
+        raise IOError(f"Скачано {stream.bytes_read} из {total_size} байт: {url}")
+    return stream.bytes_read, stream.checksum
+
+
+# Способы переноса одного файла с сайта в MinIO
+DOWNLOAD_MODES = {
+    'tempfile': download_file_to_minio,
+    'stream': stream_file_to_minio,
+    'segmented': segmented_file_to_minio,
+}
+
+def get_file_slot(file_mode, settings, limiter):
+    """
+    Слот лимита хоста для загрузки файла и параметры режима загрузки.
+
+    Обычный файл занимает один слот на всю загрузку. В режиме segmented
+    слот берет каждый Range сегмент, поэтому вместо слота передается limiter.
+    """
+    if file_mode == 'segmented':
+        return nullcontext(), dict(settings, limiter=limiter)
+    return limiter.slot(), settings
+
+
+# Настройки загрузки по датасетам (префикс имени файла до _YYYY-MM.parquet).
+# Перекрывают mode из download_missing_files, part_size и connections - только для segmented
+DATASET_DOWNLOAD_SETTINGS = {
+    'fhvhv_tripdata': {'mode': 'segmented', 'part_size': 64 * 1024 * 1024, 'connections': 8},
+}
+
+
+def get_download_settings(filename, mode, dataset_settings=None):
+    """Возвращает (режим, доп. параметры) загрузки для файла с учетом настроек датасета"""
+    dataset = filename.rsplit('_', 1)[0]
+    settings = dict((dataset_settings or DATASET_DOWNLOAD_SETTINGS).get(dataset, {}))
+    file_mode = settings.pop('mode', mode)
+
+    if file_mode not in DOWNLOAD_MODES:
+        raise ValueError(f"Неизвестный режим загрузки: {file_mode}. Доступны: {list(DOWNLOAD_MODES)}")
+    if file_mode != 'segmented':
+        settings = {}
+    return file_mode, settings
+
 
 def get_local_minio_files(bucket_name, prefix):
-    """Получить список файлов в MinIO"""
+    """
+    Получить список файлов в MinIO.
+
+    Список берется из манифеста слоя bronze одним GET запросом.
+    Если манифеста еще нет, он один раз строится по листингу префикса.
+    """
 
-    # Настройка клиента MinIO
-    minio_client = Minio(
-        "minio:9000",
-        access_key="minioadmin",
-        secret_key="minioadmin",
-        secure=False
-    )
+    # Общий клиент MinIO с пулом соединений
+    minio_client = get_minio_client()
 
     local_files = []
     try:
-        objects = minio_client.list_objects(bucket_name, prefix=prefix, recursive=True)
-        for obj in objects:
-            filename = obj.object_name.replace(f"{prefix}/", "")
-            local_files.append(filename)
+        manifest = load_manifest(minio_client, bucket_name, prefix)
+
+        if manifest is None:
+            print(f"⚠ Манифест {prefix}/{MANIFEST_NAME} не найден, строим по листингу бакета")
+            manifest = bootstrap_manifest(minio_client, bucket_name, prefix)
+            if manifest:
+                save_manifest(minio_client, bucket_name, prefix, manifest)
+
+        local_files = sorted(manifest)
     except S3Error as e:
         print(f"Ошибка при чтении бакета: {e}")
 
@@ -111,8 +601,36 @@ def download_missing_files(bucket_name = 'bronze',
                            remote_files = [],
                            local_files = [],
                            # execution_year = 2025,
+                           max_workers = 4,
+                           max_per_host = 4,
+                           mode = 'tempfile',
+                           dataset_settings = None,
+                           rechunk = False,
                            **kwargs):
-    """Загрузка только отсутствующих файлов в MinIO"""
+    """
+    Загрузка только отсутствующих файлов в MinIO.
+
+    Файлы качаются параллельно: max_workers потоков всего,
+    но не больше max_per_host одновременных файлов с одного хоста. Фактический
+    лимит по хосту адаптивный: падает вдвое на 403/429/5xx и растет на успехах.
+
+    mode:
+        'tempfile' - файл сначала пишется на диск (с докачкой после обрыва), затем fput_object
+        'stream'   - тело ответа сразу уходит в MinIO multipart upload, диск не используется
+        'segmented' - один файл качается в несколько Range соединений прямо в parts MinIO
+
+    dataset_settings - режим и параметры по датасетам, по умолчанию DATASET_DOWNLOAD_SETTINGS.
+
+    rechunk - переупаковать файл перед загрузкой в bronze (row group ~1 млн строк, zstd,
+    словари). Можно передать dict с параметрами rechunk_parquet. Переупаковка идет
+    по скачанному на диск файлу, поэтому все файлы качаются в режиме 'tempfile'.
+
+    remote_files - список имен или {filename: {etag, content_length, last_modified}}
+    (get_available_remote_files с with_meta=True). Во втором случае файлы,
+    изменившиеся на сайте относительно манифеста, загружаются заново.
+    """
+    if mode not in DOWNLOAD_MODES:
+        raise ValueError(f"Неизвестный режим загрузки: {mode}. Доступны: {list(DOWNLOAD_MODES)}")
 
 
     print("=" * 50)
@@ -128,13 +646,8 @@ def download_missing_files(bucket_name = 'bronze',
 
     print(f"🎯 Обрабатываем:")
 
-    # Настройка клиента MinIO
-    minio_client = Minio(
-        "minio:9000",
-        access_key="minioadmin",
-        secret_key="minioadmin",
-        secure=False
-    )
+    # Общий клиент MinIO с пулом соединений
+    minio_client = get_minio_client()
 
     # Создаем бакет если нужно
     try:
@@ -144,8 +657,20 @@ def download_missing_files(bucket_name = 'bronze',
     except S3Error as e:
         return [f"✗ Ошибка бакета: {e}"]
 
-    # Находим отсутствующие файлы
+    # Метаданные файлов на сайте, если их передали
+    remote_meta = remote_files if isinstance(remote_files, dict) else {}
+
+    manifest = load_manifest(minio_client, bucket_name, prefix) or {}
+
+    # Записи, построенные по листингу бакета, один раз получают ETag / размер с сайта
+    if adopt_remote_meta(manifest, remote_meta):
+        save_manifest(minio_client, bucket_name, prefix, manifest)
+
+    changed_files = get_changed_files(manifest, remote_meta)
+
+    # Находим отсутствующие и изменившиеся файлы
     missing_files = list(set(remote_files) - set(local_files))
+    refresh_files = sorted(set(changed_files) - set(missing_files))
 
     # Блок статистики
     print(f"📊 СТАТИСТИКА:")
@@ -161,72 +686,104 @@ def download_missing_files(bucket_name = 'bronze',
         for file in sorted(missing_files):
             print(f"     - {file}")
 
+    if refresh_files:
+        print(f"• Изменились на сайте, загружаем заново: {len(refresh_files)} файл(ов)")
+        for file in refresh_files:
+            print(f"     - {file}")
+
+    missing_files = missing_files + refresh_files
+
     if not missing_files:
         print("✅ Все доступные файлы уже загружены")
         return {"status": "success", "message": "Все файлы уже загружены", "downloaded_files": []}
 
-    results = []
+    results = {}
     downloaded_files = []
 
+    if rechunk:
+        # Переупаковке нужен локальный файл - stream/segmented для нее не подходят
+        rechunk_options = rechunk if isinstance(rechunk, dict) else {}
+        transform = partial(rechunk_parquet_file, **rechunk_options)
+        file_settings = {filename: ('tempfile', {'transform': transform}) for filename in missing_files}
+        print("🔧 Переупаковка parquet включена, режим загрузки: tempfile")
+    else:
+        file_settings = {
+            filename: get_download_settings(filename, mode, dataset_settings)
+            for filename in missing_files
+        }
+    max_connections = max(settings.get('connections', 1) for _, settings in file_settings.values())
+
+    session = get_http_session(pool_size=max_workers * max_connections)
+    progress = tqdm(total=0, unit='B', unit_scale=True, unit_divisor=1024, desc="Загрузка недостающих")
+    start_time = time.time()
+
+    def worker(filename):
+        url = f"{base_url}/{filename}"
+        file_mode, settings = file_settings[filename]
+        object_name = f"{prefix}/{filename}"
+        # Параллельность по хосту подстраивается под троттлинг, max_per_host - потолок
+        limiter = get_host_limiter(url, max_limit=max_per_host, purpose='download')
+        file_slot, settings = get_file_slot(file_mode, settings, limiter)
+
+        with file_slot:
+            file_size, checksum = DOWNLOAD_MODES[file_mode](
+                session=session,
+                minio_client=minio_client,
+                url=url,
+                bucket_name=bucket_name,
+                object_name=object_name,
+                progress=progress,
+                **settings,
+            )
 
+        # Читаем только footer загруженного файла: схема, строки, row group'ы, min/max
+        # После transform (переупаковка) объект в MinIO другой длины - размер берется через stat_object
+        object_size = None if settings.get('transform') else file_size
+        try:
+            parquet_info = inspect_parquet_footer(minio_client, bucket_name, object_name, size=object_size)
+        except Exception as e:
+            parquet_info = {"validation": {"status": "error", "error": str(e)}}
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1',
-    }
-
+        return file_size, checksum, parquet_info
 
-    # Скачиваем только отсутствующие файлы
-    for filename in tqdm(missing_files, desc="Загрузка недостающих"):
-        url = f"{base_url}/{filename}"
+    # Скачиваем только отсутствующие файлы, не больше max_workers одновременно
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(worker, filename): filename for filename in sorted(missing_files)}
 
-        try:
-            # response = requests.get(url, stream=True)
-            response = requests.get(url, headers=headers, stream=True)
-            response.raise_for_status()
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                file_size, checksum, parquet_info = future.result()
 
-            # Создаем временный файл
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.parquet') as temp_file:
-                temp_path = temp_file.name
+                entry = make_manifest_entry(remote_meta.get(filename, {}), file_size, checksum)
+                entry['parquet'] = parquet_info
+                manifest[filename] = entry
+                # Сохраняем после каждого файла: падение таски не теряет уже загруженные
+                save_manifest(minio_client, bucket_name, prefix, manifest)
 
-                # Скачиваем файл на диск
-                total_size = int(response.headers.get('content-length', 0))
-                for chunk in response.iter_content(chunk_size=8192 * 8):
-                    if chunk:
-                        temp_file.write(chunk)
+                result_msg = f"✓ {filename} ({file_size / (1024 * 1024):.1f} MB)"
+                downloaded_files.append(filename)
 
-            # Получаем реальный размер файла
-            file_size = os.path.getsize(temp_path)
+                validation = parquet_info['validation']
+                if validation['status'] not in ('ok', 'unknown'):
+                    result_msg += f" ⚠ схема: {validation}"
+            except Exception as e:
+                result_msg = f"✗ {filename}: {e}"
 
-            # Загружаем в MinIO
-            minio_client.fput_object(
-                bucket_name=bucket_name,
-                object_name=f"{prefix}/{filename}",
-                file_path=temp_path
-            )
+            results[filename] = result_msg
+            progress.write(result_msg)
 
-            # Удаляем временный файл
-            os.unlink(temp_path)
+    progress.close()
+    session.close()
 
-            result_msg = f"✓ {filename} ({file_size / (1024 * 1024):.1f} MB)"
-            results.append(result_msg)
-            downloaded_files.append(filename)
-            print(result_msg)
+    # Суммарная пропускная способность по всем потокам
+    execution_time = time.time() - start_time
+    total_mb = progress.n / (1024 * 1024)
+    print(f"⏱️  Загружено {total_mb:.1f} MB за {execution_time:.2f} секунд "
+          f"({total_mb / max(execution_time, 1e-6):.1f} MB/s, потоков: {max_workers}, режим: {mode})")
 
-        except Exception as e:
-            # Удаляем временный файл в случае ошибки
-            if 'temp_path' in locals():
-                try:
-                    os.unlink(temp_path)
-                except:
-                    pass
-            error_msg = f"✗ {filename}: {e}"
-            results.append(error_msg)
-            print(error_msg)
+    downloaded_files.sort()
+    results = [results[filename] for filename in sorted(results)]
 
     return {
         "status": "success" if downloaded_files else "partial_success",
@@ -0,0 +1,128 @@
+from minio.error import S3Error
+from datetime import datetime, timezone
+import io
+import json
+
+
+# Манифест лежит рядом с файлами слоя bronze
+MANIFEST_NAME = '_manifest.json'
+MANIFEST_VERSION = 1
+
+
+def get_manifest_object_name(prefix):
+    """Возвращает имя объекта манифеста для префикса"""
+    return f"{prefix.rstrip('/')}/{MANIFEST_NAME}"
+
+
+def load_manifest(minio_client, bucket_name, prefix):
+    """
+    Читает манифест из MinIO.
+
+    Возвращает dict {filename: запись} или None, если манифеста еще нет.
+    """
+    try:
+        response = minio_client.get_object(bucket_name, get_manifest_object_name(prefix))
+        try:
+            manifest = json.loads(response.read())
+        finally:
+            response.close()
+            response.release_conn()
+    except S3Error as e:
+        if e.code in ('NoSuchKey', 'NoSuchBucket'):
+            return None
+        raise
+
+    return manifest.get('files', {})
+
+
+def save_manifest(minio_client, bucket_name, prefix, files):
+    """Записывает манифест в MinIO одним объектом"""
+    body = json.dumps(
+        {'version': MANIFEST_VERSION, 'files': files},
+        ensure_ascii=False, indent=2, sort_keys=True
+    ).encode('utf-8')
+
+    minio_client.put_object(
+        bucket_name=bucket_name,
+        object_name=get_manifest_object_name(prefix),
+        data=io.BytesIO(body),
+        length=len(body),
+        content_type='application/json',
+    )
+
+
+def bootstrap_manifest(minio_client, bucket_name, prefix):
+    """
+    Строит манифест по уже лежащим в MinIO файлам (один раз, при первом запуске).
+
+    Метаданных файла на сайте для них нет: размер объекта в MinIO с
+    Content-Length сайта не сравнивается (после переупаковки parquet он
+    другой), поэтому лежит отдельно в object_size. ETag, Content-Length и
+    Last-Modified сайта записи получают при первой проверке (adopt_remote_meta).
+    """
+    files = {}
+    for obj in minio_client.list_objects(bucket_name, prefix=f"{prefix.rstrip('/')}/", recursive=True):
+        filename = obj.object_name.replace(f"{prefix.rstrip('/')}/", "")
+        if filename == MANIFEST_NAME:
+            continue
+        files[filename] = {
+            'etag': None,
+            'content_length': None,
+            'last_modified': None,
+            'object_size': obj.size,
+            'downloaded_at': obj.last_modified.isoformat() if obj.last_modified else None,
+            'checksum': None,
+        }
+    return files
+
+
+def is_remote_changed(entry, remote_meta):
+    """
+    Сравнивает запись манифеста с метаданными файла на сайте.
+
+    Сравниваются только известные с обеих сторон поля: ETag, Content-Length, Last-Modified.
+    """
+    for field in ('etag', 'content_length', 'last_modified'):
+        local_value = entry.get(field)
+        remote_value = remote_meta.get(field)
+        if local_value and remote_value and local_value != remote_value:
+            return True
+    return False
+
+
+def adopt_remote_meta(manifest, remote_meta):
+    """
+    Заполняет метаданными сайта записи без них (построенные bootstrap_manifest).
+
+    Файл в MinIO считается актуальным на момент первой проверки, дальше
+    изменения на сайте отслеживаются обычным сравнением. Возвращает имена обновленных записей.
+    """
+    adopted = []
+    for filename, meta in remote_meta.items():
+        entry = manifest.get(filename)
+        if entry is None or any(entry.get(field) for field in ('etag', 'content_length', 'last_modified')):
+            continue
+        for field in ('etag', 'content_length', 'last_modified'):
+            entry[field] = meta.get(field)
+        adopted.append(filename)
+    return adopted
+
+
+def get_changed_files(manifest, remote_meta):
+    """Возвращает файлы, которые уже есть в манифесте, но изменились на сайте"""
+    return [
+        filename
+        for filename, meta in remote_meta.items()
+        if filename in manifest and is_remote_changed(manifest[filename], meta)
+    ]
+
+
+def make_manifest_entry(remote_meta, file_size, checksum):
+    """Формирует запись манифеста для только что загруженного файла"""
+    return {
+        'etag': remote_meta.get('etag'),
+        'content_length': remote_meta.get('content_length') or file_size,
+        'last_modified': remote_meta.get('last_modified'),
+        'downloaded_at': datetime.now(timezone.utc).isoformat(),
+        'checksum': checksum,
+    }
@@ -0,0 +1,193 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import date, datetime
+import io
+
+from module.nyc_taxi_schema import get_dataset_name, get_dataset_year, validate_columns
+
+
+# Целевая раскладка bronze: ~1 млн строк в row group, zstd, словарное кодирование
+RECHUNK_ROW_GROUP_SIZE = 1_000_000
+RECHUNK_COMPRESSION = "zstd"
+RECHUNK_COMPRESSION_LEVEL = 3
+
+
+class MinioRangeFile(io.RawIOBase):
+    """
+    Файл в MinIO с произвольным доступом через Range GET.
+
+    pyarrow читает через него только footer parquet файла:
+    последние байты с длиной метаданных и сами метаданные, без скана данных.
+    """
+
+    def __init__(self, minio_client, bucket_name, object_name, size=None):
+        self._client = minio_client
+        self._bucket_name = bucket_name
+        self._object_name = object_name
+        self._size = size if size is not None else minio_client.stat_object(bucket_name, object_name).size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = self._size + offset
+        return self._position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self._size - self._position)
+        if length <= 0:
+            return 0
+
+        response = self._client.get_object(self._bucket_name, self._object_name,
+                                           offset=self._position, length=length)
+        try:
+            data = response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+def get_logical_type(arrow_type):
+    """Приводит тип pyarrow к логическому типу схемы: int / double / timestamp / string"""
+    if pa.types.is_integer(arrow_type):
+        return "int"
+    if pa.types.is_floating(arrow_type) or pa.types.is_decimal(arrow_type):
+        return "double"
+    if pa.types.is_timestamp(arrow_type) or pa.types.is_date(arrow_type):
+        return "timestamp"
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return "string"
+    return str(arrow_type)
+
+
+def to_json_value(value):
+    """Значения статистик parquet -> JSON совместимые"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+
+def collect_column_stats(metadata):
+    """Сводит min/max/null_count колонок по всем row group'ам файла"""
+    stats = {}
+
+    for rg_index in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg_index)
+
+        for col_index in range(row_group.num_columns):
+            column = row_group.column(col_index)
+            name = column.path_in_schema.lower()
+            col_stats = stats.setdefault(name, {"min": None, "max": None, "null_count": 0})
+
+            statistics = column.statistics
+            if statistics is None:
+                continue
+
+            if statistics.has_null_count and col_stats["null_count"] is not None:
+                col_stats["null_count"] += statistics.null_count
+            else:
+                col_stats["null_count"] = None
+
+            if statistics.has_min_max:
+                if col_stats["min"] is None or statistics.min < col_stats["min"]:
+                    col_stats["min"] = statistics.min
+                if col_stats["max"] is None or statistics.max > col_stats["max"]:
+                    col_stats["max"] = statistics.max
+
+    return {
+        name: {key: to_json_value(value) for key, value in col_stats.items()}
+        for name, col_stats in stats.items()
+    }
+
+
+def inspect_parquet_footer(minio_client, bucket_name, object_name, size=None):
+    """
+    Читает footer parquet файла в MinIO и сверяет схему с ожидаемой.
+
+    Возвращает сводку для манифеста: число строк, размеры row group'ов,
+    min/max/null_count по колонкам и результат валидации схемы.
+    """
+    raw = MinioRangeFile(minio_client, bucket_name, object_name, size=size)
+    with io.BufferedReader(raw, buffer_size=64 * 1024) as source:
+        parquet_file = pq.ParquetFile(source)
+        metadata = parquet_file.metadata
+        arrow_schema = parquet_file.schema_arrow
+
+    columns = {field.name: get_logical_type(field.type) for field in arrow_schema}
+
+    return {
+        "num_rows": metadata.num_rows,
+        "num_row_groups": metadata.num_row_groups,
+        "row_groups": [
+            {
+                "num_rows": metadata.row_group(i).num_rows,
+                "total_byte_size": metadata.row_group(i).total_byte_size,
+            }
+            for i in range(metadata.num_row_groups)
+        ],
+        "schema": {name.lower(): kind for name, kind in columns.items()},
+        "columns": collect_column_stats(metadata),
+        "validation": validate_columns(get_dataset_name(object_name), columns, year=get_dataset_year(object_name)),
+    }
+
+
+def rechunk_parquet(source_path, target_path, row_group_size=RECHUNK_ROW_GROUP_SIZE,
+                    compression=RECHUNK_COMPRESSION, compression_level=RECHUNK_COMPRESSION_LEVEL,
+                    batch_size=64 * 1024):
+    """
+    Переписывает parquet файл с заданным размером row group и сжатием.
+
+    Исходный файл читается батчами, в памяти одновременно держится
+    не больше одной целевой row group.
+    """
+    parquet_file = pq.ParquetFile(source_path)
+    schema = parquet_file.schema_arrow
+
+    with pq.ParquetWriter(target_path, schema,
+                          compression=compression,
+                          compression_level=compression_level,
+                          use_dictionary=True,
+                          write_statistics=True) as writer:
+        batches = []
+        rows = 0
+
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            batches.append(batch)
+            rows += batch.num_rows
+
+            # Набрали на row group - пишем ровно row_group_size строк, хвост оставляем
+            if rows >= row_group_size:
+                table = pa.Table.from_batches(batches, schema=schema)
+                writer.write_table(table.slice(0, row_group_size), row_group_size=row_group_size)
+
+                rest = table.slice(row_group_size)
+                batches = rest.to_batches()
+                rows = rest.num_rows
+
+        if rows:
+            writer.write_table(pa.Table.from_batches(batches, schema=schema), row_group_size=row_group_size)
+
+    return target_path
+
+
+def rechunk_parquet_file(path, **options):
+    """Трансформация для download_file_to_minio: пишет переупакованную копию рядом с файлом"""
+    return rechunk_parquet(path, f"{path}.rechunked.parquet", **options)
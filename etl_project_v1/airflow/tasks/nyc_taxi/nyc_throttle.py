@@ -0,0 +1,236 @@
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import random
+import threading
+import time
+
+import requests
+
+
+# Ответы, на которые сайт отвечает, когда мы слишком торопимся
+THROTTLE_STATUSES = frozenset({403, 429, 500, 502, 503, 504})
+
+# При проверке доступности 403 означает "файла нет" (CloudFront поверх S3), а не троттлинг
+PROBE_THROTTLE_STATUSES = THROTTLE_STATUSES - {403}
+
+# Темп запросов к одному хосту по умолчанию
+DEFAULT_RATE = 20.0
+DEFAULT_BURST = 40
+
+# Время до заголовков ответа, после которого хост считается перегруженным (как троттлинг)
+DEFAULT_LATENCY_TARGET = 5.0
+
+# Параметры повторов с экспоненциальной задержкой
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+
+class TokenBucket:
+    """Ограничивает темп запросов: rate токенов в секунду, не больше burst подряд"""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Блокируется, пока не появится токен"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """
+    Адаптивный лимит одновременных операций к хосту (AIMD).
+
+    Каждые limit успешных ответов подряд лимит растет на 1 до max_limit,
+    на троттлинг или медленный ответ - падает вдвое, не чаще раза в cooldown секунд.
+    """
+
+    def __init__(self, max_limit, min_limit=1, latency_target=DEFAULT_LATENCY_TARGET, cooldown=1.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.limit = max(min_limit, (max_limit + 1) // 2)
+
+        self._in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def on_success(self, latency=None):
+        if self.latency_target and latency is not None and latency > self.latency_target:
+            self.on_throttle()
+            return
+
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def on_throttle(self):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._successes = 0
+
+            new_limit = max(self.min_limit, self.limit // 2)
+            if new_limit != self.limit:
+                print(f"  ⚠ Троттлинг: лимит параллельности {self.limit} → {new_limit}")
+            self.limit = new_limit
+
+    def set_max_limit(self, max_limit):
+        """Меняет потолок в обе стороны; текущий лимит не выше нового потолка"""
+        with self._condition:
+            self.max_limit = max(self.min_limit, max_limit)
+            self.limit = min(self.limit, self.max_limit)
+            self._condition.notify_all()
+
+
+class HostThrottle:
+    """
+    Темп и параллельность запросов к одному хосту.
+
+    Темп (TokenBucket) общий на хост, лимит параллельности - свой на каждое
+    назначение (проверка доступности, загрузка), чтобы потолок одного не
+    перекрывал потолок другого. Троттлинг хоста снижает все лимиты.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, latency_target=DEFAULT_LATENCY_TARGET):
+        self.bucket = TokenBucket(rate=rate, burst=burst)
+        self.latency_target = latency_target
+        self.limiters = {}
+        self._lock = threading.Lock()
+
+    def get_limiter(self, purpose, max_limit):
+        """AdaptiveLimiter назначения purpose с потолком max_limit (последний вызов задает потолок)"""
+        with self._lock:
+            limiter = self.limiters.get(purpose)
+            if limiter is None:
+                limiter = self.limiters[purpose] = AdaptiveLimiter(max_limit=max_limit,
+                                                                   latency_target=self.latency_target)
+                return limiter
+        limiter.set_max_limit(max_limit)
+        return limiter
+
+    def on_success(self, latency=None):
+        for limiter in list(self.limiters.values()):
+            limiter.on_success(latency)
+
+    def on_throttle(self):
+        for limiter in list(self.limiters.values()):
+            limiter.on_throttle()
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def get_host_throttle(url, **options):
+    """
+    Возвращает общий на процесс HostThrottle для хоста из url.
+
+    Параметры (rate, burst, latency_target) применяются при первом обращении.
+    """
+    host = urlparse(url).netloc
+    with _throttles_lock:
+        throttle = _throttles.get(host)
+        if throttle is None:
+            throttle = _throttles[host] = HostThrottle(**options)
+    return throttle
+
+
+def get_host_limiter(url, max_limit=4, purpose='download'):
+    """
+    Лимит параллельности к хосту из url для назначения purpose ('probe', 'download').
+
+    Проверка доступности и загрузка в одном процессе делят темп и обратную
+    связь о троттлинге хоста, но не потолок: max_limit проверки не поднимает
+    потолок загрузки. Повторный вызов с тем же purpose может потолок и понизить.
+    """
+    return get_host_throttle(url).get_limiter(purpose, max_limit)
+
+
+def get_backoff(attempt, response=None):
+    """Задержка перед повтором: Retry-After, если сайт его прислал, иначе 2^attempt с джиттером"""
+    if response is not None:
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return min(BACKOFF_MAX, float(retry_after))
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class ThrottledSession(requests.Session):
+    """
+    requests.Session с темпом, обратной связью в AIMD и повторами.
+
+    Каждый запрос берет токен у хоста, результат сообщается адаптивному
+    лимиту хоста. На троттлинг и сетевые ошибки запрос повторяется
+    с экспоненциальной задержкой до max_retries раз.
+    throttle_statuses и retries можно переопределить на один запрос:
+    session.get(url, throttle_statuses=..., retries=0) - retries=0, если повторы
+    делает сам вызывающий код (иначе число попыток перемножается).
+    """
+
+    def __init__(self, max_retries=MAX_RETRIES):
+        super().__init__()
+        self.max_retries = max_retries
+
+    def request(self, method, url, *args, throttle_statuses=THROTTLE_STATUSES, retries=None, **kwargs):
+        throttle = get_host_throttle(url)
+        max_retries = self.max_retries if retries is None else retries
+
+        for attempt in range(max_retries + 1):
+            throttle.bucket.acquire()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                throttle.on_throttle()
+                if attempt == max_retries:
+                    raise
+                time.sleep(get_backoff(attempt))
+                continue
+
+            if response.status_code not in throttle_statuses:
+                throttle.on_success(response.elapsed.total_seconds())
+                return response
+
+            throttle.on_throttle()
+            if attempt == max_retries:
+                return response
+
+            response.close()
+            time.sleep(get_backoff(attempt, response))
+
+        return response
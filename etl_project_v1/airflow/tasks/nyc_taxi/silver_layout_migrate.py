@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Перевод слоя silver на партиционированную раскладку year=/month=.
+
+Было:   silver/nyc-taxi-data-norm/yellow_tripdata_2025-01/part-*.parquet
+        silver/nyc-taxi-data-norm/slice=yellow_tripdata_2025-01/part-*.parquet
+Стало:  silver/nyc-taxi-data-norm/year=2025/month=1/run=<run_id>/part-*.parquet
+
+nyc-taxi-data-norm - файлы переносятся как есть (копирование на стороне MinIO
+без скачивания), колонок year / month в них нет, месяц задает папка.
+
+nyc-taxi-data-eda - в старых файлах year / month / day записаны колонками
+и вычислены по времени посадки, поэтому переносить их нельзя: старые папки
+удаляются, и следующий запуск silver_norm_to_eda пересчитывает эти месяцы
+из нормализованного слоя уже в новую раскладку.
+
+Срез с _SUCCESS публикуется указателем _SUCCESS месяца на перенесенную версию
+run=, как это делает write_parquet_published. Срезы без маркера (недописанные)
+переносятся без публикации и после миграции будут пересчитаны.
+
+Если папка месяца в новой раскладке уже есть, старая папка не переносится
+(данные новой раскладки свежее) и удаляется только с --drop-duplicates.
+
+По умолчанию только печатает план, изменения - с --apply.
+
+Запуск:
+    python -m tasks.nyc_taxi.silver_layout_migrate
+    python -m tasks.nyc_taxi.silver_layout_migrate --apply
+"""
+import argparse
+
+from module.storage import (
+    list_prefix,
+    list_objects,
+    list_month_partitions,
+    extract_month_from_filename,
+    month_partition_prefix,
+    month_run_prefix,
+    make_run_id,
+    copy_prefix,
+    remove_prefix,
+    has_success_marker,
+    write_success_marker,
+    invalidate_listing_cache,
+)
+
+
+BUCKET = 'silver'
+NORM_PREFIX = 'nyc-taxi-data-norm/'
+EDA_PREFIX = 'nyc-taxi-data-eda/'
+
+
+def get_legacy_slices(bucket_name, prefix):
+    """Папки срезов старой раскладки: [(папка, 'YYYY-MM')]"""
+    slices = []
+    for object_name, is_dir in list_prefix(bucket_name, prefix, recursive=False, use_cache=False):
+        if not is_dir or object_name[len(prefix):].startswith('year='):
+            continue
+        month = extract_month_from_filename(object_name)
+        if month:
+            slices.append((object_name, month))
+    return slices
+
+
+def migrate_norm(bucket_name, prefix, apply, drop_duplicates, max_workers):
+    """Переносит нормализованные срезы в папки year=/month="""
+    existing = {month for _, month in list_month_partitions(bucket_name, prefix)}
+
+    for slice_prefix, month in get_legacy_slices(bucket_name, prefix):
+        month_prefix = month_partition_prefix(prefix, month)
+        run_id = make_run_id()
+        target_prefix = month_run_prefix(month_prefix, run_id)
+
+        if month in existing:
+            action = "удаляю (месяц уже в новой раскладке)" if drop_duplicates else "пропускаю (месяц уже в новой раскладке)"
+            print(f"  {slice_prefix} -> {action}")
+            if apply and drop_duplicates:
+                remove_prefix(bucket_name, slice_prefix)
+            continue
+
+        print(f"  {slice_prefix} -> {target_prefix}")
+        if apply:
+            complete = has_success_marker(bucket_name, slice_prefix)
+            files = [name for name in list_objects(bucket_name, slice_prefix) if name.endswith('.parquet')]
+            copied = copy_prefix(bucket_name, slice_prefix, target_prefix, max_workers)
+            if complete:
+                write_success_marker(bucket_name, month_prefix, {'run_id': run_id, 'files': len(files),
+                                                                 'migrated_from': slice_prefix})
+            removed = remove_prefix(bucket_name, slice_prefix)
+            state = "опубликовано" if complete else "без _SUCCESS, не опубликовано"
+            print(f"    ✓ скопировано {copied} ({state}), удалено {removed} объектов")
+        existing.add(month)
+
+
+def migrate_eda(bucket_name, prefix, apply):
+    """Удаляет срезы EDA старой раскладки - они будут пересчитаны в новую"""
+    for slice_prefix, month in get_legacy_slices(bucket_name, prefix):
+        print(f"  {slice_prefix} -> удаляю, {month} будет пересчитан silver_norm_to_eda")
+        if apply:
+            removed = remove_prefix(bucket_name, slice_prefix)
+            print(f"    ✓ удалено {removed} объектов")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Миграция silver на раскладку year=/month=')
+    parser.add_argument('--bucket', default=BUCKET)
+    parser.add_argument('--norm-prefix', default=NORM_PREFIX)
+    parser.add_argument('--eda-prefix', default=EDA_PREFIX)
+    parser.add_argument('--apply', action='store_true', help='Выполнить перенос, без флага - только план')
+    parser.add_argument('--drop-duplicates', action='store_true',
+                        help='Удалять старые папки месяцев, которые уже есть в новой раскладке')
+    parser.add_argument('--max-workers', type=int, default=16)
+    args = parser.parse_args()
+
+    if not args.apply:
+        print("🔍 Пробный запуск, изменений не будет (добавьте --apply)")
+
+    print(f"📁 {args.bucket}/{args.norm_prefix}")
+    migrate_norm(args.bucket, args.norm_prefix, args.apply, args.drop_duplicates, args.max_workers)
+
+    print(f"📁 {args.bucket}/{args.eda_prefix}")
+    migrate_eda(args.bucket, args.eda_prefix, args.apply)
+
+    invalidate_listing_cache(args.bucket)
+    print("🎉 Готово")
+
+
+if __name__ == '__main__':
+    main()
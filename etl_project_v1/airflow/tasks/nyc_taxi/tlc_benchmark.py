@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+Замер пропускной способности загрузчика NYC TLC без обращения к CloudFront.
+
+Поднимает локальное зеркало (tlc_mirror) или использует --base-url,
+прогоняет проверку доступности и каждый режим загрузки и печатает
+files/s, MB/s и время до первого байта (TTFB).
+
+По умолчанию файлы никуда не загружаются (DiscardMinioClient), с --minio
+загрузка идет в настоящий MinIO из compose.
+
+Запуск:
+    python -m tasks.nyc_taxi.tlc_benchmark --files 12 --file-size-mb 32 --bandwidth-mbps 10
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import statistics
+import time
+
+from tasks.nyc_taxi.nyc_download import (
+    DOWNLOAD_MODES,
+    get_available_remote_files,
+    get_file_slot,
+    get_http_session,
+    remove_partial,
+    PARTIAL_DIR,
+)
+from tasks.nyc_taxi.nyc_throttle import get_host_limiter
+from tasks.nyc_taxi.tlc_mirror import MirrorConfig, start_mirror
+
+
+FILENAME_TEMPLATE = 'yellow_tripdata_{year}-{month:02d}.parquet'
+
+
+class DiscardMinioClient:
+    """
+    Приемник вместо MinIO: вычитывает данные и выбрасывает их.
+
+    Повторяет ровно те методы клиента, которые вызывает загрузчик.
+    """
+
+    def fput_object(self, bucket_name, object_name, file_path, **kwargs):
+        with open(file_path, 'rb') as f:
+            while f.read(8 * 1024 * 1024):
+                pass
+
+    def put_object(self, bucket_name, object_name, data, length, part_size=0, **kwargs):
+        while data.read(part_size or 8 * 1024 * 1024):
+            pass
+
+
+def percentile(values, q):
+    """Перцентиль q (0..100) без numpy"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def benchmark_probe(base_url, years, max_workers):
+    """Время проверки доступности файлов за несколько лет"""
+    start = time.time()
+    files = get_available_remote_files(base_url, FILENAME_TEMPLATE, years=years, max_workers=max_workers)
+    elapsed = time.time() - start
+    checked = len(list(years)) * 12
+    return {'checked': checked, 'available': len(files), 'seconds': elapsed, 'files_per_s': checked / elapsed}
+
+
+def benchmark_mode(mode, base_url, filenames, minio_client, max_workers, max_per_host, settings):
+    """Прогоняет один режим загрузки по всем файлам и собирает метрики"""
+    session = get_http_session(pool_size=max_workers * settings.get('connections', 1))
+
+    # requests кладет в response.elapsed время до получения заголовков - это и есть TTFB
+    ttfb = []
+    session.hooks['response'].append(lambda response, *args, **kwargs: ttfb.append(response.elapsed.total_seconds()))
+
+    def worker(filename):
+        url = f"{base_url}/{filename}"
+        object_name = f"benchmark/{filename}"
+        limiter = get_host_limiter(url, max_limit=max_per_host, purpose='download')
+        file_slot, file_settings = get_file_slot(mode, settings, limiter)
+        with file_slot:
+            size, _ = DOWNLOAD_MODES[mode](
+                session=session,
+                minio_client=minio_client,
+                url=url,
+                bucket_name='benchmark',
+                object_name=object_name,
+                **file_settings,
+            )
+        return size
+
+    total_bytes = 0
+    errors = 0
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(worker, filename) for filename in filenames]
+        for future in as_completed(futures):
+            try:
+                total_bytes += future.result()
+            except Exception as e:
+                errors += 1
+                print(f"  ✗ {mode}: {e}")
+
+    elapsed = time.time() - start
+    session.close()
+
+    return {
+        'mode': mode,
+        'files': len(filenames) - errors,
+        'errors': errors,
+        'seconds': elapsed,
+        'files_per_s': (len(filenames) - errors) / elapsed,
+        'mb_per_s': total_bytes / (1024 * 1024) / elapsed,
+        'ttfb_p50_ms': percentile(ttfb, 50) * 1000,
+        'ttfb_p95_ms': percentile(ttfb, 95) * 1000,
+        'ttfb_mean_ms': statistics.mean(ttfb) * 1000 if ttfb else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк загрузчика NYC TLC')
+    parser.add_argument('--base-url', default=None, help='Готовое зеркало; по умолчанию поднимается локальное')
+    parser.add_argument('--files', type=int, default=12)
+    parser.add_argument('--modes', default=','.join(DOWNLOAD_MODES))
+    parser.add_argument('--max-workers', type=int, default=4)
+    parser.add_argument('--max-per-host', type=int, default=4)
+    parser.add_argument('--part-size-mb', type=int, default=8)
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--probe-years', type=int, default=10)
+    parser.add_argument('--minio', action='store_true', help='Загружать в настоящий MinIO (бакет benchmark)')
+    # Параметры локального зеркала
+    parser.add_argument('--file-size-mb', type=float, default=32)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--bandwidth-mbps', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--abort-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        config = MirrorConfig(
+            file_size=int(args.file_size_mb * 1024 * 1024),
+            latency=args.latency_ms / 1000,
+            bandwidth=int(args.bandwidth_mbps * 1024 * 1024),
+            error_rate=args.error_rate,
+            abort_rate=args.abort_rate,
+            last_month='2099-12',
+            seed=42,
+            # Все файлы замера в памяти: повторная генерация исказила бы замер режимов
+            body_cache_size=args.files,
+        )
+        server, base_url = start_mirror(config)
+        print(f"🪞 Локальное зеркало: {base_url}")
+
+    if args.minio:
+        from module.storage import get_minio_client
+        minio_client = get_minio_client()
+        if not minio_client.bucket_exists('benchmark'):
+            minio_client.make_bucket('benchmark')
+    else:
+        minio_client = DiscardMinioClient()
+
+    filenames = [
+        FILENAME_TEMPLATE.format(year=2000 + i // 12, month=i % 12 + 1)
+        for i in range(args.files)
+    ]
+
+    try:
+        if server is not None:
+            # Файлы генерируются до замера, иначе первый режим мерил бы генератор parquet
+            print(f"🧱 Генерация {len(filenames)} файлов зеркала ...")
+            with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+                list(executor.map(lambda filename: config.bodies.get(filename, config.file_size), filenames))
+
+        probe = benchmark_probe(base_url, range(2015, 2015 + args.probe_years), args.max_workers * 4)
+
+        results = []
+        for mode in args.modes.split(','):
+            settings = {}
+            if mode == 'segmented':
+                settings = {'part_size': args.part_size_mb * 1024 * 1024, 'connections': args.connections}
+
+            # Чекпоинты прошлых прогонов исказили бы замер режима tempfile
+            for filename in filenames:
+                remove_partial(f"{PARTIAL_DIR}/benchmark__{filename}.part")
+
+            print(f"⏱️  Режим {mode} ...")
+            results.append(benchmark_mode(mode, base_url, filenames, minio_client,
+                                          args.max_workers, args.max_per_host, settings))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print()
+    print("=" * 80)
+    print(f"🔍 Проверка доступности: {probe['checked']} файлов за {probe['seconds']:.2f} с "
+          f"({probe['files_per_s']:.1f} files/s, доступно {probe['available']})")
+    print("=" * 80)
+    print(f"{'режим':<10} {'файлов':>7} {'ошибок':>7} {'сек':>8} {'files/s':>8} {'MB/s':>8} "
+          f"{'TTFB p50':>9} {'TTFB p95':>9}")
+    for r in results:
+        print(f"{r['mode']:<10} {r['files']:>7} {r['errors']:>7} {r['seconds']:>8.2f} {r['files_per_s']:>8.2f} "
+              f"{r['mb_per_s']:>8.1f} {r['ttfb_p50_ms']:>7.1f}ms {r['ttfb_p95_ms']:>7.1f}ms")
+    print("=" * 80)
+
+
+if __name__ == '__main__':
+    main()
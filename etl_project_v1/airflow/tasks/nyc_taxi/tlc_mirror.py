@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+"""
+Локальная замена сайта NYC TLC (CloudFront) для тестов и замеров загрузчика.
+
+Отдает синтетические, но настоящие parquet файлы вида {dataset}_{year}-{month}.parquet
+(колонки из реестра nyc_taxi_schema, время посадки внутри месяца файла), поэтому
+переупаковка и чтение footer'а в замерах работают как на реальных файлах.
+Размер каждого файла ровно --file-size-mb: HEAD отвечает без генерации файла,
+и проверка доступности меряет загрузчик, а не генератор parquet.
+    - HEAD и GET, Range: bytes=a-b / bytes=a- с If-Range по ETag
+    - задержка перед ответом (latency), ограничение скорости на соединение
+    - случайные ошибки: 503 до ответа или обрыв посреди тела
+
+Запуск:
+    python -m tasks.nyc_taxi.tlc_mirror --port 8765 --file-size-mb 64 --bandwidth-mbps 20
+Базовый URL для загрузчика: http://localhost:8765/trip-data
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import Future
+from collections import OrderedDict
+from email.utils import formatdate
+import argparse
+import hashlib
+import random
+import struct
+import re
+import threading
+import time
+import io
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from module.nyc_taxi_schema import DATASET_SCHEMAS, get_schema_version
+
+
+FILENAME_PATTERN = re.compile(r'^/trip-data/(?P<dataset>\w+?)_(?P<year>\d{4})-(?P<month>\d{2})\.parquet$')
+RANGE_PATTERN = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+# Размер блока, которым отдается тело файла
+BLOCK_SIZE = 64 * 1024
+
+# Строк в row group синтетического файла и в пробной записи для оценки размера строки
+ROW_GROUP_ROWS = 128 * 1024
+SAMPLE_ROWS = 50_000
+
+# Сколько сгенерированных файлов держать в памяти (по умолчанию)
+BODY_CACHE_SIZE = 8
+
+# Доля размера файла под данные: остаток добивается пустыми байтами до точного размера
+DATA_SIZE_RATIO = 0.95
+
+
+class MirrorConfig:
+    """Параметры зеркала, общие для всех потоков сервера"""
+
+    def __init__(self, file_size=64 * 1024 * 1024, latency=0.0, bandwidth=0,
+                 error_rate=0.0, abort_rate=0.0, last_month='2025-08', seed=None,
+                 body_cache_size=BODY_CACHE_SIZE):
+        self.file_size = file_size      # точный размер каждого файла в байтах
+        self.latency = latency          # секунды до ответа
+        self.bandwidth = bandwidth      # байт/с на соединение, 0 - без ограничения
+        self.error_rate = error_rate    # доля запросов с ответом 503
+        self.abort_rate = abort_rate    # доля GET с обрывом посреди тела
+        self.last_month = last_month    # файлы после этого месяца "еще не опубликованы"
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.bodies = BodyCache(body_cache_size)
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+
+def make_batch(columns, year, month, rows, rng):
+    """Синтетические строки поездки в месяце year-month по логическим типам колонок"""
+    month = np.datetime64(f"{year:04d}-{month:02d}", 'M')
+    month_start = month.astype('datetime64[s]')
+    month_seconds = int(((month + 1).astype('datetime64[s]') - month_start).astype(np.int64))
+    pickup = month_start + rng.integers(0, month_seconds, rows).astype('timedelta64[s]')
+
+    arrays = {}
+    for name, kind in columns.items():
+        if kind == 'timestamp':
+            values = pickup + rng.integers(60, 3600, rows).astype('timedelta64[s]') if 'dropoff' in name else pickup
+            arrays[name] = pa.array(values.astype('datetime64[us]'))
+        elif kind == 'int':
+            arrays[name] = pa.array(rng.integers(1, 266, rows, dtype=np.int64))
+        elif kind == 'double':
+            arrays[name] = pa.array(np.round(rng.gamma(2.0, 5.0, rows), 2))
+        else:
+            arrays[name] = pa.array(rng.choice(['N', 'Y'], rows))
+    return pa.table(arrays)
+
+
+def pad_parquet(raw, size):
+    """
+    Добивает parquet файл пустыми байтами до size между данными и footer'ом.
+
+    Читатели находят footer по последним 8 байтам, а колонки - по смещениям
+    из footer'а, поэтому байты перед footer'ом файл не портят.
+    """
+    footer_length = struct.unpack('<I', raw[-8:-4])[0]
+    footer_start = len(raw) - 8 - footer_length
+    return raw[:footer_start] + bytes(size - len(raw)) + raw[footer_start:]
+
+
+def make_parquet_body(name, size):
+    """
+    Детерминированный parquet файл размером ровно size байт.
+
+    Колонки - версия схемы датасета для года файла (для датасетов без схемы -
+    yellow_tripdata). Число строк подбирается по пробной записи так, чтобы
+    данные заняли около DATA_SIZE_RATIO файла, остаток добивается pad_parquet.
+    Файл пишется row group'ами по ROW_GROUP_ROWS, в памяти одновременно одна row group.
+    """
+    match = FILENAME_PATTERN.match(f"/trip-data/{name}")
+    dataset, year, month = match['dataset'], int(match['year']), int(match['month'])
+    if dataset not in DATASET_SCHEMAS:
+        dataset = 'yellow_tripdata'
+
+    schema, _ = DATASET_SCHEMAS[dataset]
+    columns = {column: schema[column] for column in get_schema_version(dataset, year)['columns']}
+    rng = np.random.default_rng(int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], 'big'))
+
+    sample = io.BytesIO()
+    pq.write_table(make_batch(columns, year, month, SAMPLE_ROWS, rng), sample)
+    rows = max(1, int(size * DATA_SIZE_RATIO / (sample.tell() / SAMPLE_ROWS)))
+
+    while True:
+        body = io.BytesIO()
+        writer = None
+        try:
+            for offset in range(0, rows, ROW_GROUP_ROWS):
+                batch = make_batch(columns, year, month, min(ROW_GROUP_ROWS, rows - offset), rng)
+                if writer is None:
+                    writer = pq.ParquetWriter(body, batch.schema)
+                writer.write_table(batch)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        raw = body.getvalue()
+        if len(raw) <= size:
+            return pad_parquet(raw, size)
+        if rows == 1:
+            raise ValueError(f"Размер файла {size} байт меньше минимального parquet файла ({len(raw)} байт)")
+        # Оценка по выборке промахнулась: строк меньше пропорционально перебору
+        rows = max(1, int(rows * size * DATA_SIZE_RATIO / len(raw)))
+
+
+class BodyCache:
+    """
+    Сгенерированные тела файлов: LRU на max_size файлов.
+
+    Генерация идет вне общей блокировки: параллельные запросы одного файла
+    ждут одну генерацию (Future), запросы других файлов не ждут ничего.
+    """
+
+    def __init__(self, max_size=BODY_CACHE_SIZE):
+        self.max_size = max_size
+        self.bodies = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def get(self, name, size):
+        key = (name, size)
+        with self.lock:
+            body = self.bodies.get(key)
+            if body is not None:
+                self.bodies.move_to_end(key)
+                return body
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            body = make_parquet_body(name, size)
+        except BaseException as e:
+            with self.lock:
+                del self.pending[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.pending[key]
+            self.bodies[key] = body
+            while len(self.bodies) > self.max_size:
+                self.bodies.popitem(last=False)
+        future.set_result(body)
+        return body
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = MirrorConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def resolve(self):
+        """Возвращает имя файла или None, если такого файла на "сайте" нет"""
+        match = FILENAME_PATTERN.match(self.path)
+        if not match:
+            return None
+        if f"{match['year']}-{match['month']}" > self.config.last_month:
+            return None
+        return self.path.rsplit('/', 1)[-1]
+
+    def send_empty(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def handle_request(self, with_body):
+        config = self.config
+
+        if config.latency:
+            time.sleep(config.latency)
+
+        if config.roll(config.error_rate):
+            return self.send_empty(503)
+
+        name = self.resolve()
+        if name is None:
+            # CloudFront поверх S3 отвечает 403 на несуществующие объекты
+            return self.send_empty(403)
+
+        size = config.file_size
+        etag = f'"{hashlib.md5(f"{name}:{size}".encode()).hexdigest()}"'
+        start, end = 0, size - 1
+        status = 200
+
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_header and (if_range is None or if_range == etag):
+            match = RANGE_PATTERN.match(range_header)
+            if not match or int(match.group(1)) >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'binary/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(0, usegmt=True))
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        self.end_headers()
+
+        if with_body:
+            self.write_body(config.bodies.get(name, size), start, end)
+
+    def write_body(self, body, start, end):
+        """Пишет байты [start, end] с ограничением скорости и возможным обрывом"""
+        config = self.config
+        abort_at = None
+        if config.roll(config.abort_rate):
+            abort_at = start + (end - start) // 2
+
+        position = start
+        chunk_started = time.time()
+        while position <= end:
+            length = min(BLOCK_SIZE, end - position + 1)
+
+            if abort_at is not None and position + length > abort_at:
+                self.close_connection = True
+                return
+
+            self.wfile.write(body[position:position + length])
+            position += length
+
+            # Ограничение скорости: досыпаем, если отдали быстрее, чем позволяет bandwidth
+            if config.bandwidth:
+                expected = length / config.bandwidth
+                elapsed = time.time() - chunk_started
+                if expected > elapsed:
+                    time.sleep(expected - elapsed)
+                chunk_started = time.time()
+
+    def do_HEAD(self):
+        self.handle_request(with_body=False)
+
+    def do_GET(self):
+        self.handle_request(with_body=True)
+
+
+def start_mirror(config, host='127.0.0.1', port=0):
+    """
+    Запускает зеркало в фоновом потоке.
+
+    Возвращает (server, base_url). Остановка - server.shutdown().
+    """
+    handler = type('ConfiguredMirrorHandler', (MirrorHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base_url = f"http://{host}:{server.server_address[1]}/trip-data"
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальное зеркало NYC TLC trip-data')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--file-size-mb', type=float, default=64, help='Размер parquet файла')
+    parser.add_argument('--body-cache-size', type=int, default=BODY_CACHE_SIZE,
+                        help='Сколько сгенерированных файлов держать в памяти')
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--bandwidth-mbps', type=float, default=0, help='MB/s на соединение, 0 - без ограничения')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--abort-rate', type=float, default=0.0)
+    parser.add_argument('--last-month', default='2025-08')
+    args = parser.parse_args()
+
+    config = MirrorConfig(
+        file_size=int(args.file_size_mb * 1024 * 1024),
+        latency=args.latency_ms / 1000,
+        bandwidth=int(args.bandwidth_mbps * 1024 * 1024),
+        error_rate=args.error_rate,
+        abort_rate=args.abort_rate,
+        last_month=args.last_month,
+        body_cache_size=args.body_cache_size,
+    )
+    server, base_url = start_mirror(config, host=args.host, port=args.port)
+
+    print(f"🪞 Зеркало TLC запущено: {base_url}")
+    print("Нажмите Ctrl+C для остановки")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print("\nЗеркало остановлено")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,127 @@
 from pyspark.sql import functions as F
 from pyspark.sql import SparkSession
+import argparse
 import time
-
-
-def main(write_table):
-    """Основная функция Spark приложения"""
+import uuid
+import re
+
+from query_cache import invalidate_tables
+from storage import list_published_months
+
+
+EDA_BUCKET = "silver"
+EDA_PREFIX = "nyc-taxi-data-eda/"
+EDA_ROOT = f"s3a://{EDA_BUCKET}/{EDA_PREFIX}"
+
+JDBC_URL = "jdbc:postgresql://postgres-db:5432/learn_base"
+JDBC_USER = "airflow"
+JDBC_PASSWORD = "airflow"
+
+# Формат границ периода --from-month / --to-month (подставляются в SQL DELETE)
+MONTH_PATTERN = re.compile(r'\d{4}-(0[1-9]|1[0-2])')
+
+
+def month_arg(value):
+    """Тип аргумента argparse для месяца 'YYYY-MM': неверное значение отсекается до записи"""
+    if not MONTH_PATTERN.fullmatch(value):
+        raise argparse.ArgumentTypeError(f"Ожидается месяц в формате YYYY-MM, получено: {value!r}")
+    return value
+
+
+def read_eda(spark, from_month=None, to_month=None):
+    """
+    Читает слой EDA в партиционированной раскладке year=/month=.
+
+    Читаются только опубликованные версии месяцев из периода ('YYYY-MM'):
+    папка run=<run_id>/, на которую указывает _SUCCESS месяца. Недописанные
+    версии, старые версии до удаления и не входящие в период месяцы Spark
+    даже не листит. С basePath year и month становятся колонками партиций,
+    старые папки yellow_tripdata_YYYY-MM/ не читаются.
+    """
+    paths = [
+        f"s3a://{EDA_BUCKET}/{run_prefix}"
+        for _, run_prefix in list_published_months(EDA_BUCKET, EDA_PREFIX, from_month, to_month)
+    ]
+    if not paths:
+        raise ValueError(f"В {EDA_ROOT} нет опубликованных месяцев за период {from_month} - {to_month}")
+    print(f"Месяцев к чтению: {len(paths)}")
+
+    df = (spark.read
+          .option("basePath", EDA_ROOT)
+          .parquet(*paths)
+          .drop("run"))
+    return df
+
+
+def write_jdbc(df, table, mode):
+    """Пишет DataFrame в таблицу Postgres через JDBC"""
+    (df.write.format("jdbc")
+     .option("url", JDBC_URL)
+     .option("driver", "org.postgresql.Driver")
+     .option("user", JDBC_USER)
+     .option("password", JDBC_PASSWORD)
+     .option("dbtable", table)
+     .option("batchsize", 10000)
+     .mode(mode)
+     .save())
+
+
+def replace_months_in_table(spark, df_agg, write_table, from_month=None, to_month=None):
+    """
+    Заменяет в таблице агрегаты за период одной транзакцией.
+
+    1. Spark пишет агрегаты периода в отдельную staging таблицу (JDBC, параллельно)
+    2. в одной транзакции (JDBC драйвер в JVM): DELETE строк периода из write_table
+       и INSERT ... SELECT из staging таблицы
+    3. staging таблица удаляется
+
+    Пока идет запись, читатели видят старые строки периода; упавшая запись
+    не оставляет период пустым.
+    """
+    conditions = []
+    if from_month:
+        conditions.append(f"date_month >= DATE '{from_month}-01'")
+    if to_month:
+        conditions.append(f"date_month < DATE '{to_month}-01' + INTERVAL '1 month'")
+
+    staging_table = f"{write_table}_staging_{uuid.uuid4().hex[:8]}"
+    columns = ", ".join(f'"{column}"' for column in df_agg.columns)
+
+    connection = spark._jvm.java.sql.DriverManager.getConnection(JDBC_URL, JDBC_USER, JDBC_PASSWORD)
+    try:
+        write_jdbc(df_agg, staging_table, "overwrite")
+
+        connection.setAutoCommit(False)
+        statement = connection.createStatement()
+        try:
+            statement.executeUpdate(f"CREATE TABLE IF NOT EXISTS {write_table} (LIKE {staging_table})")
+            deleted = statement.executeUpdate(f"DELETE FROM {write_table} WHERE {' AND '.join(conditions)}")
+            inserted = statement.executeUpdate(
+                f"INSERT INTO {write_table} ({columns}) SELECT {columns} FROM {staging_table}"
+            )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.setAutoCommit(True)
+
+        print(f"Строки периода в {write_table} заменены: удалено {deleted}, вставлено {inserted}")
+    finally:
+        try:
+            connection.createStatement().executeUpdate(f"DROP TABLE IF EXISTS {staging_table}")
+        finally:
+            connection.close()
+
+
+def main(write_table, from_month=None, to_month=None):
+    """
+    Основная функция Spark приложения.
+
+    Без периода - агрегаты по всем месяцам, таблица перезаписывается.
+    С периодом (--from-month / --to-month) - читаются только партиции периода,
+    строки периода в таблице заменяются, остальные месяцы не трогаются.
+    """
 
     print("\n\n")
 
@@ -28,7 +145,9 @@ def main(write_table):
 
     start_time = time.time()
 
-    df = spark.read.parquet("s3a://silver/nyc-taxi-data-eda/*")  # yellow_tripdata_2025-09/")
+    df = read_eda(spark, from_month, to_month)
+    if from_month or to_month:
+        print(f"Период: {from_month or '...'} - {to_month or '...'}")
 
     print(f"Общий размер датасета: {df.count()} строк.")
 
@@ -97,19 +216,20 @@ def main(write_table):
         print()
 
 
-        (df_agg.write.format("jdbc")
-         .option("url", "jdbc:postgresql://postgres-db:5432/learn_base")
-         .option("driver", "org.postgresql.Driver")
-         .option("user", "airflow")
-         .option("password", "airflow")
-         .option("dbtable", write_table)
-         .option("batchsize", 10000)
-         .mode("overwrite")
-         .save())
+        if from_month or to_month:
+            replace_months_in_table(spark, df_agg, write_table, from_month, to_month)
+        else:
+            write_jdbc(df_agg, write_table, "overwrite")
 
         execution_time = time.time() - start_time
         print(f"⏱️  Датасет записан за: {execution_time:.2f} секунд ({execution_time / 60:.2f} минут)")
 
+        # Таблица перезаписана - закешированные по ней результаты запросов больше не актуальны
+        try:
+            invalidate_tables(write_table)
+        except Exception as e:
+            print(f"⚠️ Не удалось сбросить кеш запросов для {write_table}: {e}")
+
         print("\n\n")
     except Exception as e:
         print(f"💥 Критическая ошибка в приложении: {e}")
@@ -119,4 +239,11 @@ def main(write_table):
 
 
 if __name__ == "__main__":
-    main(write_table="nyc_taxi.nyc_taxi_agg_table")
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--from-month', type=month_arg, default=None, help='YYYY-MM')
+    parser.add_argument('--to-month', type=month_arg, default=None, help='YYYY-MM')
+    args = parser.parse_args()
+    if args.from_month and args.to_month and args.from_month > args.to_month:
+        parser.error(f"--from-month {args.from_month} позже --to-month {args.to_month}")
+
+    main(write_table="nyc_taxi.nyc_taxi_agg_table", from_month=args.from_month, to_month=args.to_month)
\ No newline at end of file
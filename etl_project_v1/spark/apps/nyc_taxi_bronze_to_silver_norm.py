@@ -1,163 +1,120 @@
 from pyspark.sql import functions as F
-from pyspark.sql.types import DoubleType, IntegerType
 from pyspark.sql import SparkSession
-import re
-from minio import Minio
-from minio.error import S3Error
 import time
 
 import ast
 import argparse
 
-# Конфигурация MinIO
-MINIO_ENDPOINT = 'minio:9000'
-MINIO_ACCESS_KEY = 'minioadmin'
-MINIO_SECRET_KEY = 'minioadmin'
-
-
-def get_minio_client():
-    """Создает и возвращает клиент MinIO"""
-    return Minio(
-        MINIO_ENDPOINT,
-        access_key=MINIO_ACCESS_KEY,
-        secret_key=MINIO_SECRET_KEY,
-        secure=False
+# Общие функции работы с MinIO: airflow/module/storage.py, приходит через --py-files
+from storage import get_processed_slices, get_input_files_with_months
+# Реестр схем датасетов: airflow/module/nyc_taxi_schema.py, приходит через --py-files
+from nyc_taxi_schema import compile_projection, get_dataset_name, get_dataset_year, get_schema_version
+# Запись файлами заданного размера: airflow/module/spark_writer.py, приходит через --py-files
+from spark_writer import write_parquet_published
+
+
+# Раскладка silver: nyc-taxi-data-norm/year=2025/month=1/ - месяц среза (файла в bronze),
+# чтения с фильтром по year / month читают только нужные папки
+PARTITION_COLUMNS = ["year", "month"]
+
+# Файлы среза нарезаются по времени посадки - узкие min/max для отбора файлов по дате
+SORT_COLUMN = "tpep_pickup_datetime"
+
+def normalize_nyc_taxi_df(df, source_name, all_columns=False, extra_columns=()):
+    """
+    Приводит имена и типы колонок NYC Taxi к схеме из реестра nyc_taxi_schema.
+
+    Датасет и год берутся из source_name (yellow_tripdata_2025-01.parquet),
+    вся нормализация - один select (compile_projection).
+    all_columns=True - все колонки схемы, в том числе отсутствующие в файле
+    (cbd_congestion_fee до 2025 года), чтобы месяцы разных лет можно было
+    объединить в один DataFrame. extra_columns добавляются в тот же select.
+    Колонки файла, которых нет в реестре, не теряются молча - о них печатается отчет.
+    """
+    dataset = get_dataset_name(source_name)
+    year = get_dataset_year(source_name)
+
+    columns, report = compile_projection(dataset, year, df.schema, all_columns=all_columns)
+
+    print(f"   Схема {dataset} v{report['schema_version']} для {source_name}")
+    if report['unmapped_columns']:
+        print(f"   ⚠️ Колонки без описания в реестре (отброшены): {', '.join(report['unmapped_columns'])}")
+    if report['missing_columns']:
+        print(f"   ⚠️ Нет в файле, заполнены по умолчанию: {', '.join(report['missing_columns'])}")
+    for name, change in report['reconciled_types'].items():
+        print(f"   🔧 {name}: {change['actual']} -> {change['expected']}")
+
+    return df.select(*columns, *extra_columns)
+
+
+def read_normalized_month(spark, file_info, all_columns=False):
+    """Читает файл месяца из bronze, нормализует и добавляет колонки партиций year / month"""
+    year, month = file_info['month'].split('-')
+    return normalize_nyc_taxi_df(
+        spark.read.parquet(file_info['path']),
+        file_info['file_name'],
+        all_columns=all_columns,
+        extra_columns=[F.lit(int(year)).alias("year"), F.lit(int(month)).alias("month")],
     )
 
 
-def extract_month_from_filename(file_path):
-    """Извлекает месяц из имени файла в формате YYYY-MM"""
-    match = re.search(r'(\d{4}-\d{2})', file_path)
-    return match.group(1) if match else None
-
-
-def get_processed_slices(output_bucket, output_prefix):
-    """Возвращает список уже обработанных срезов из выходного бакета используя MinIO"""
-    try:
-        client = get_minio_client()
-        processed_slices = set()
+def standardize_nyc_taxi_data(spark, file_info, output_bucket, output_prefix):
+    """Стандартизирует данные NYC Taxi одного месяца и публикует в папку year=/month="""
+    df_standardized = read_normalized_month(spark, file_info)
 
-        objects = client.list_objects(output_bucket, prefix=output_prefix, recursive=True)
-
-        for obj in objects:
-            month = extract_month_from_filename(obj.object_name)
-            if month:
-                processed_slices.add(month)
-
-        print(f"📁 Найдено обработанных срезов в {output_bucket}/{output_prefix}: {len(processed_slices)}")
-        return processed_slices
-
-    except S3Error as e:
-        if e.code == 'NoSuchBucket':
-            print(f"⚠️ Бакет {output_bucket} не существует или пустой")
-        else:
-            print(f"⚠️ Ошибка при чтении {output_bucket} бакета: {e}")
-        return set()
-    except Exception as e:
-        print(f"⚠️ Не удалось прочитать {output_bucket} бакет: {e}")
-        return set()
+    write_parquet_published(df_standardized, output_bucket, output_prefix, [file_info['month']],
+                            partition_by=PARTITION_COLUMNS, sort_column=SORT_COLUMN)
 
+    print(f"✅ Стандартизировано: {file_info['path']} -> {output_bucket}/{output_prefix}")
+    return df_standardized
 
-def get_input_files_with_months(input_bucket, input_prefix):
-    """Возвращает список файлов/папок из входного бакета с извлеченными месяцами используя MinIO"""
-    try:
-        client = get_minio_client()
-        input_files = []
 
-        objects = client.list_objects(input_bucket, prefix=input_prefix, recursive=False)
+def standardize_nyc_taxi_batch(spark, new_files, output_bucket, output_prefix):
+    """
+    Стандартизирует все новые месяцы одним Spark джобом.
 
-        for obj in objects:
-            object_name = obj.object_name
+    Каждый файл читается отдельно (схемы месяцев различаются - типы и набор
+    колонок), приводится к полной схеме из реестра и помечается колонками
+    year / month месяца среза. Месяцы объединяются в один DataFrame и пишутся
+    за один проход с partitionBy(year, month) новой версией run=, затем каждый
+    месяц публикуется маркером _SUCCESS (write_parquet_published): заменяются
+    только месяцы из этого запуска, остальные не трогаются.
+    Задачи чтения всех месяцев идут в одной стадии и загружают все ядра кластера.
+    """
+    frames = [read_normalized_month(spark, file_info, all_columns=True) for file_info in new_files]
 
-            is_parquet_file = object_name.endswith('.parquet')
-            is_folder = not is_parquet_file and object_name.endswith('/')
+    df_batch = frames[0]
+    for frame in frames[1:]:
+        df_batch = df_batch.unionByName(frame)
 
-            if is_parquet_file or is_folder:
-                month = extract_month_from_filename(object_name)
-                if month:
-                    s3_path = f"s3a://{input_bucket}/{object_name}"
-                    input_files.append({
-                        'path': s3_path,
-                        'month': month,
-                        'file_name': object_name.split('/')[-1] if is_parquet_file else object_name.split('/')[-2] + '/'
-                    })
+    write_parquet_published(df_batch, output_bucket, output_prefix, [f['month'] for f in new_files],
+                            partition_by=PARTITION_COLUMNS, sort_column=SORT_COLUMN)
 
-        print(f"📁 Найдено объектов в {input_bucket}/{input_prefix}: {len(input_files)}")
-        return input_files
+    print(f"✅ Стандартизировано срезов: {len(new_files)} -> {output_bucket}/{output_prefix}")
+    return df_batch
 
-    except Exception as e:
-        print(f"❌ Ошибка при чтении {input_bucket} бакета: {e}")
-        return []
-
-
-def standardize_nyc_taxi_data(spark, input_path, output_path):
-    """Стандартизирует данные NYC Taxi"""
-    output_path = output_path.replace('.parquet', '')
-
-    df = spark.read.parquet(input_path)
-
-    for col_name in df.columns:
-        df = df.withColumnRenamed(col_name, col_name.lower())
-
-    type_mapping = {
-        "vendorid": IntegerType(),
-        "pulocationid": IntegerType(),
-        "dolocationid": IntegerType(),
-        "payment_type": IntegerType(),
-        "ratecodeid": IntegerType(),
-        "passenger_count": IntegerType(),
-        "fare_amount": DoubleType(),
-        "extra": DoubleType(),
-        "mta_tax": DoubleType(),
-        "tip_amount": DoubleType(),
-        "tolls_amount": DoubleType(),
-        "improvement_surcharge": DoubleType(),
-        "total_amount": DoubleType(),
-        "congestion_surcharge": DoubleType(),
-        "airport_fee": DoubleType(),
-        "cbd_congestion_fee": DoubleType(),
-        "trip_distance": DoubleType()
-    }
-
-    for col_name, target_type in type_mapping.items():
-        if col_name in df.columns:
-            df = df.withColumn(
-                col_name,
-                F.coalesce(
-                    F.col(col_name).cast(target_type),
-                    F.lit(0 if target_type == IntegerType() else 0.0)
-                )
-            )
-
-    expected_columns = [
-        "vendorid", "tpep_pickup_datetime", "tpep_dropoff_datetime",
-        "passenger_count", "trip_distance", "ratecodeid", "store_and_fwd_flag",
-        "pulocationid", "dolocationid", "payment_type", "fare_amount", "extra",
-        "mta_tax", "tip_amount", "tolls_amount", "improvement_surcharge",
-        "total_amount", "congestion_surcharge", "airport_fee", "cbd_congestion_fee"
-    ]
-
-    final_columns = [col for col in expected_columns if col in df.columns]
-    df_standardized = df.select(final_columns)
-
-    (df_standardized
-     .coalesce(1)
-     .write
-     .mode("overwrite")
-     .option("compression", "snappy")
-     .parquet(output_path)
-     )
-
-    print(f"✅ Стандартизировано: {input_path} -> {output_path}")
-    return df_standardized
 
+def process_incremental_nyc_taxi_files(spark, input_bucket, input_prefix, output_bucket, output_prefix, mode="batch"):
+    """
+    Обрабатывает только новые файлы NYC Taxi из входного бакета в выходной.
 
-def process_incremental_nyc_taxi_files(spark, input_bucket, input_prefix, output_bucket, output_prefix):
-    """Обрабатывает только новые файлы NYC Taxi из входного бакета в выходной"""
+    mode="batch"    - все новые месяцы одним джобом (standardize_nyc_taxi_batch)
+    mode="per_file" - отдельный джоб на каждый месяц
+    """
 
-    processed_slices = get_processed_slices(output_bucket, output_prefix)
+    # Готов только месяц с _SUCCESS - недописанный упавшим запуском обрабатывается заново
+    processed_slices = get_processed_slices(output_bucket, output_prefix, require_success=True)
     input_files = get_input_files_with_months(input_bucket, input_prefix)
 
+    # Слой nyc-taxi-data-norm - одна схема на месяц. Файлы датасетов без схемы в реестре
+    # (green / fhv / fhvhv) не нормализуются, чтобы не уронить весь батч и не смешать
+    # их в партиции year=/month= с yellow
+    skipped = sorted({get_dataset_name(f['file_name']) for f in input_files
+                      if get_schema_version(get_dataset_name(f['file_name'])) is None})
+    if skipped:
+        print(f"⚠️ Датасеты без схемы в nyc_taxi_schema пропущены: {', '.join(skipped)}")
+        input_files = [f for f in input_files if get_dataset_name(f['file_name']) not in skipped]
+
     new_files = [f for f in input_files if f['month'] not in processed_slices]
 
     print(f"📊 Статистика:")
@@ -169,16 +126,17 @@ def process_incremental_nyc_taxi_files(spark, input_bucket, input_prefix, output
         print("🎉 Все срезы уже обработаны! Ничего делать не нужно.")
         return
 
-    for i, file_info in enumerate(new_files, 1):
-        input_path = file_info['path']
-        file_name = file_info['file_name']
-
-        output_path = f"s3a://{output_bucket}/{output_prefix}{file_name}".replace('.parquet', '')
+    if mode == "batch":
+        print(f"🔄 Обрабатываю новые срезы одним джобом: {', '.join(f['month'] for f in new_files)}")
+        standardize_nyc_taxi_batch(spark, new_files, output_bucket, output_prefix)
+        print(f"🎉 Обработка завершена! Обработано {len(new_files)} новых срезов.")
+        return
 
+    for i, file_info in enumerate(new_files, 1):
         print(f"🔄 Обрабатываю новый срез ({i}/{len(new_files)}): {file_info['month']}")
 
         try:
-            standardize_nyc_taxi_data(spark, input_path, output_path)
+            standardize_nyc_taxi_data(spark, file_info, output_bucket, output_prefix)
             print(f"✅ Успешно обработан: {file_info['month']}")
             print()
         except Exception as e:
@@ -196,6 +154,7 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--input-data', type=str, required=True)
     parser.add_argument('--execution-date', type=str, required=True)
+    parser.add_argument('--mode', type=str, default='batch', choices=['batch', 'per_file'])
 
     # Парсим аргументы
     args = parser.parse_args()
@@ -252,7 +211,8 @@ def main():
             input_bucket='bronze',
             input_prefix='nyc-taxi-data/',
             output_bucket='silver',
-            output_prefix='nyc-taxi-data-norm/'
+            output_prefix='nyc-taxi-data-norm/',
+            mode=args.mode
         )
 
         execution_time = time.time() - start_time
@@ -1,95 +1,26 @@
 from pyspark.sql import functions as F
 from pyspark.sql.types import DoubleType, IntegerType
 from pyspark.sql import SparkSession
-import re
-from minio import Minio
-from minio.error import S3Error
 import time
 
-# Конфигурация MinIO
-MINIO_ENDPOINT = 'minio:9000'
-MINIO_ACCESS_KEY = 'minioadmin'
-MINIO_SECRET_KEY = 'minioadmin'
+# Общие функции работы с MinIO: airflow/module/storage.py, приходит через --py-files
+from storage import get_processed_slices, get_input_files_with_months
+# Запись файлами заданного размера: airflow/module/spark_writer.py, приходит через --py-files
+from spark_writer import write_parquet_published, estimate_size_bytes
 
 
-def get_minio_client():
-    """Создает и возвращает клиент MinIO"""
-    return Minio(
-        MINIO_ENDPOINT,
-        access_key=MINIO_ACCESS_KEY,
-        secret_key=MINIO_SECRET_KEY,
-        secure=False
-    )
-
-
-def extract_month_from_filename(file_path):
-    """Извлекает месяц из имени файла в формате YYYY-MM"""
-    match = re.search(r'(\d{4}-\d{2})', file_path)
-    return match.group(1) if match else None
-
-
-def get_processed_slices(output_bucket, output_prefix):
-    """Возвращает список уже обработанных срезов из выходного бакета используя MinIO"""
-    try:
-        client = get_minio_client()
-        processed_slices = set()
-
-        objects = client.list_objects(output_bucket, prefix=output_prefix, recursive=True)
-
-        for obj in objects:
-            month = extract_month_from_filename(obj.object_name)
-            if month:
-                processed_slices.add(month)
-
-        print(f"📁 Найдено обработанных срезов в {output_bucket}/{output_prefix}: {len(processed_slices)}")
-        return processed_slices
-
-    except S3Error as e:
-        if e.code == 'NoSuchBucket':
-            print(f"⚠️ Бакет {output_bucket} не существует или пустой")
-        else:
-            print(f"⚠️ Ошибка при чтении {output_bucket} бакета: {e}")
-        return set()
-    except Exception as e:
-        print(f"⚠️ Не удалось прочитать {output_bucket} бакет: {e}")
-        return set()
-
-
-def get_input_files_with_months(input_bucket, input_prefix):
-    """Возвращает список файлов/папок из входного бакета с извлеченными месяцами используя MinIO"""
-    try:
-        client = get_minio_client()
-        input_files = []
-
-        objects = client.list_objects(input_bucket, prefix=input_prefix, recursive=False)
-
-        for obj in objects:
-            object_name = obj.object_name
-
-            is_parquet_file = object_name.endswith('.parquet')
-            is_folder = not is_parquet_file and object_name.endswith('/')
+# Раскладка silver: nyc-taxi-data-eda/year=2025/month=1/[day=15/]
+# PARTITION_BY_DAY=True добавляет уровень day= для выборок по отдельным дням
+PARTITION_BY_DAY = False
+PARTITION_COLUMNS = ["year", "month", "day"] if PARTITION_BY_DAY else ["year", "month"]
 
-            if is_parquet_file or is_folder:
-                month = extract_month_from_filename(object_name)
-                if month:
-                    s3_path = f"s3a://{input_bucket}/{object_name}"
-                    input_files.append({
-                        'path': s3_path,
-                        'month': month,
-                        'file_name': object_name.split('/')[-1] if is_parquet_file else object_name.split('/')[-2] + '/'
-                    })
-
-        print(f"📁 Найдено объектов в {input_bucket}/{input_prefix}: {len(input_files)}")
-        return input_files
-
-    except Exception as e:
-        print(f"❌ Ошибка при чтении {input_bucket} бакета: {e}")
-        return []
 
-
-def eda_nyc_taxi_data(spark, input_path, output_path):
+def eda_nyc_taxi_data(spark, input_path, output_bucket, output_prefix, month):
     """
-    Очищает данные NYC Taxi
+    Очищает данные NYC Taxi одного месяца.
+
+    Месяц пишется новой версией в папку year=/month= под output_prefix и
+    публикуется маркером _SUCCESS (write_parquet_published).
     """
     df = spark.read.format("parquet").load(input_path)
 
@@ -128,6 +59,10 @@ def eda_nyc_taxi_data(spark, input_path, output_path):
         # Добавьте другие условия по необходимости
     )
 
+    # Только поездки месяца среза: year / month из времени посадки совпадают с папкой партиции,
+    # и перезапись месяца не затрагивает соседние (записи с чужой датой - аномалии)
+    df_clean = df_clean.filter(F.date_format("tpep_pickup_datetime", "yyyy-MM") == month)
+
     # Обогащаем
 
     df_clean = (df_clean
@@ -227,8 +162,8 @@ def eda_nyc_taxi_data(spark, input_path, output_path):
 
     print("ДАННЫЕ ОБОГАЩЕНЫ СПРАВОЧНИКАМИ")
 
-    # 5. Сохраняем с оптимальными настройками
-    (df_joined
+    # 5. Сохраняем файлами ~128 MB, нарезанными и отсортированными по времени посадки
+    df_result = (df_joined
     .select([
         'vendorid',
         'vendor_name',
@@ -270,15 +205,13 @@ def eda_nyc_taxi_data(spark, input_path, output_path):
         'tip_ratio',
         'has_tip',
         'revenue_per_minute',
-    ])
-     .coalesce(1)
-     .write
-     .mode("overwrite")
-     .option("compression", "snappy")
-     .parquet(output_path)
-     )
-
-    print(f"✅ Стандартизировано: {input_path} -> {output_path}")
+    ]))
+
+    # Объем оцениваем до join со справочниками: оценка плана с join без CBO сильно завышена
+    write_parquet_published(df_result, output_bucket, output_prefix, [month], partition_by=PARTITION_COLUMNS,
+                            sort_column="tpep_pickup_datetime", size_bytes=estimate_size_bytes(df_clean))
+
+    print(f"✅ Стандартизировано: {input_path} -> {output_bucket}/{output_prefix}")
     return df_clean
 
 
@@ -286,9 +219,17 @@ def eda_incremental_nyc_taxi_files(spark, input_bucket, input_prefix, output_buc
     """Обрабатывает только новые файлы NYC Taxi из входного бакета в выходной"""
 
     # Получаем списки обработанных и доступных файлов через MinIO
-    processed_slices = get_processed_slices(output_bucket, output_prefix)
+    # Готов только опубликованный месяц - недописанный упавшим запуском обрабатывается заново.
+    # Папки старой раскладки yellow_tripdata_YYYY-MM/ агрегаты не читают, поэтому
+    # такие месяцы пересчитываются в year=/month= (иначе агрегаты потеряли бы историю)
+    processed_slices = get_processed_slices(output_bucket, output_prefix, require_success=True,
+                                            count_legacy=False)
     input_files = get_input_files_with_months(input_bucket, input_prefix)
 
+    # Берем только опубликованные (с _SUCCESS) нормализованные месяцы
+    published_inputs = get_processed_slices(input_bucket, input_prefix, require_success=True)
+    input_files = [f for f in input_files if f['month'] in published_inputs]
+
     # Фильтруем только новые файлы
     new_files = [f for f in input_files if f['month'] not in processed_slices]
 
@@ -306,17 +247,15 @@ def eda_incremental_nyc_taxi_files(spark, input_bucket, input_prefix, output_buc
     # Обрабатываем только новые файлы
     for i, file_info in enumerate(new_files, 1):
         input_path = file_info['path']
-        file_name = file_info['file_name']
 
-        # Формируем выходной путь, сохраняя структуру после префикса
-        # Пример: входной путь s3a://bronze/nyc-taxi-data/yellow_tripdata_2022-01
-        # Выходной путь: s3a://silver/nyc-taxi-data/yellow_tripdata_2022-01
-        output_path = f"s3a://{output_bucket}/{output_prefix}{file_name}".replace('.parquet', '')
+        # Месяц публикуется в свою партицию под общим корнем
+        # Пример: входной путь s3a://silver/nyc-taxi-data-norm/year=2022/month=1/run=<run_id>/
+        # Выходной путь: s3a://silver/nyc-taxi-data-eda/year=2022/month=1/run=<run_id>/
 
         print(f"🔄 Обрабатываю новый срез ({i}/{len(new_files)}): {file_info['month']}")
 
         try:
-            eda_nyc_taxi_data(spark, input_path, output_path)
+            eda_nyc_taxi_data(spark, input_path, output_bucket, output_prefix, file_info['month'])
             print(f"✅ Успешно обработан: {file_info['month']}")
             print()
         except Exception as e: